@@ -22,6 +22,8 @@ class Maon:
         self.client.run(login.TOKEN)
 
 
-Maon = Maon()
-Maon.load_extensions()
-Maon.run()
+# The library build starts worker processes that import this module again on Windows and macOS
+if __name__ == "__main__":
+    Maon = Maon()
+    Maon.load_extensions()
+    Maon.run()
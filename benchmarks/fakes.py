@@ -0,0 +1,182 @@
+from discord.errors import ClientException
+from itertools import count
+from time import perf_counter
+from time import sleep
+import threading
+
+
+ids = count(1000)
+
+
+class FakeBot:
+    """ Just enough of a discord.py bot for the Audio cog: its event loop, its cogs and its own user. """
+    __slots__ = ["loop", "cogs", "user"]
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.cogs = {}
+        self.user = FakeUser("Maon")
+
+    def get_cog(self, name: str):
+        return self.cogs.get(name)
+
+    async def wait_until_ready(self):
+        pass
+
+
+class FakeUser:
+    __slots__ = ["id", "name", "voice"]
+
+    def __init__(self, name: str, voice_channel=None):
+        self.id = next(ids)
+        self.name = name
+        self.voice = FakeVoiceState(voice_channel) if voice_channel is not None else None
+
+
+class FakeVoiceState:
+    __slots__ = ["channel"]
+
+    def __init__(self, channel):
+        self.channel = channel
+
+
+class FakeTextChannel:
+    """ Records every message Maon sends with the time it was sent. The harness counts the "Now playing" messages
+    to know when a requested song started. """
+    __slots__ = ["id", "messages", "now_playing"]
+
+    def __init__(self):
+        self.id = next(ids)
+        self.messages = []      # (seconds, content)
+        self.now_playing = []   # seconds a song started
+
+    async def send(self, content=None, **kwargs):
+        now = perf_counter()
+        self.messages.append((now, content))
+        if content and content.startswith(":cd: Now playing"):
+            self.now_playing.append(now)
+
+    async def purge(self, **kwargs):
+        pass
+
+
+class FakeVoiceChannel:
+    __slots__ = ["id", "guild", "voice_states"]
+
+    def __init__(self, guild):
+        self.id = next(ids)
+        self.guild = guild
+        self.voice_states = {}
+
+    async def connect(self):
+        self.guild.voice_client = FakeVoiceClient(self, self.guild.speed)
+        self.voice_states[self.guild.bot_id] = FakeVoiceState(self)
+        return self.guild.voice_client
+
+
+class FakeGuild:
+    """ A guild with one text and one voice channel and a listener in it. `speed` is how many times faster than
+    real time its voice client plays, 0 reads frames as fast as the sources deliver them. """
+    __slots__ = ["id", "name", "bot_id", "voice_client", "text_channel", "voice_channel", "listener", "speed"]
+
+    def __init__(self, bot, speed: float):
+        self.id = next(ids)
+        self.name = "Guild {}".format(self.id)
+        self.bot_id = bot.user.id
+        self.voice_client = None
+        self.speed = speed
+        self.text_channel = FakeTextChannel()
+        self.voice_channel = FakeVoiceChannel(self)
+        self.listener = FakeUser("Listener", self.voice_channel)
+        self.voice_channel.voice_states[self.listener.id] = self.listener.voice
+
+    def message(self):
+        """ Returns the context of a command the listener sent. """
+        return FakeContext(self, self.listener, self.text_channel)
+
+
+class FakeContext:
+    __slots__ = ["guild", "author", "channel", "invoked_with"]
+
+    def __init__(self, guild, author, channel):
+        self.guild = guild
+        self.author = author
+        self.channel = channel
+        self.invoked_with = "play"
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+class FakeVoiceClient:
+    """ Plays sources like the voice client of discord.py does, a thread reads one frame after another and calls
+    `after` once the source ended, but the frames are thrown away instead of being encoded and sent. """
+    __slots__ = ["channel", "speed", "source", "after", "thread", "playing", "paused", "stopped", "frames"]
+
+    def __init__(self, channel, speed: float):
+        self.channel = channel
+        self.speed = speed
+        self.source = None
+        self.after = None
+        self.thread = None
+        self.playing = False
+        self.paused = False
+        self.stopped = threading.Event()
+        self.frames = 0
+
+    def play(self, source, *, after=None):
+        if self.playing:
+            raise ClientException("Already playing audio.")
+        self.source = source
+        self.after = after
+        self.playing = True
+        self.paused = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(source, after, self.stopped), daemon=True)
+        self.thread.start()
+
+    def run(self, source, after, stopped):
+        error = None
+        try:
+            while not stopped.is_set():
+                if self.paused:
+                    sleep(0.02)
+                    continue
+                if not source.read():
+                    break
+                source.is_opus()
+                self.frames += 1
+                if self.speed > 0:
+                    sleep(0.02 / self.speed)
+        except Exception as e:
+            error = e
+        finally:
+            source.cleanup()
+            if self.stopped is stopped:
+                self.playing = False
+        if after is not None:
+            after(error)
+
+    def is_playing(self):
+        return self.playing and not self.paused
+
+    def is_paused(self):
+        return self.playing and self.paused
+
+    def is_connected(self):
+        return True
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    def stop(self):
+        self.stopped.set()
+        self.playing = False
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self.channel.voice_states.pop(self.channel.guild.bot_id, None)
+        self.channel.guild.voice_client = None
@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+from http.server import SimpleHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.request import urlopen
+import configuration as config
+import asyncio
+import os
+import subprocess
+import threading
+
+
+# format_id: (file name, ext, acodec, FFmpeg arguments of the encoder)
+FIXTURE_FORMATS = {
+    "251": ("fixture.webm", "webm", "opus", ["-c:a", "libopus", "-b:a", "128k"]),
+    "140": ("fixture.m4a", "m4a", "mp4a.40.2", ["-c:a", "aac", "-b:a", "128k"])
+}
+# What a finished download looks like, Opus copied into an Ogg file
+DOWNLOAD_FIXTURE = ("fixture.opus", ["-c:a", "libopus", "-b:a", "128k"])
+
+
+class FixtureServer:
+    """ Serves the fixture files over HTTP on a free local port, so FFmpeg streams them with the same options it
+    uses for Youtube and downloads go over a socket as well. """
+    __slots__ = ["path", "server", "thread"]
+
+    def __init__(self, path: str):
+        self.path = path
+        root = path
+
+        class Handler(SimpleHTTPRequestHandler):
+            def translate_path(self, url_path):
+                return os.path.join(root, os.path.basename(url_path.split("?")[0]))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, filename: str, video_id: str):
+        return "http://127.0.0.1:{}/{}?v={}".format(self.server.server_address[1], filename, video_id)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LocalExtractor:
+    """ Takes the place of the youtube_dl engine of the Audio cog. Every video id is answered with the meta data of
+    the fixture files, which FFmpeg streams from the fixture server, and downloads copy the Opus fixture into the
+    temp folder through the shared bandwidth of the cog. `info_latency` seconds stand in for the lookup on
+    Youtube. """
+    __slots__ = ["client", "server", "bandwidth", "duration", "info_latency", "info_executor", "download_executor",
+                 "lookups", "downloads"]
+
+    def __init__(self, client, server, bandwidth, duration: float, info_latency: float, download_threads: int):
+        self.client = client
+        self.server = server
+        self.bandwidth = bandwidth
+        self.duration = duration
+        self.info_latency = info_latency
+        self.info_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fixture-info")
+        self.download_executor = ThreadPoolExecutor(max_workers=download_threads, thread_name_prefix="fixture-download")
+        self.lookups = 0
+        self.downloads = 0
+
+    async def extract_info(self, url: str):
+        self.lookups += 1
+        await asyncio.sleep(self.info_latency)
+        video_id = video_id_of(url)
+        formats = []
+        for format_id, (filename, ext, acodec, _) in FIXTURE_FORMATS.items():
+            formats.append({
+                "format_id": format_id,
+                "url": self.server.url(filename, video_id),
+                "ext": ext,
+                "acodec": acodec,
+                "vcodec": "none",
+                "filesize": os.path.getsize(os.path.join(self.server.path, filename))
+            })
+        return {"id": video_id, "title": "Fixture " + video_id, "duration": self.duration, "formats": formats}
+
+    async def extract_playlist(self, url: str):
+        await asyncio.sleep(self.info_latency)
+        return []
+
+    async def download(self, url: str, format_id: str, transfer):
+        return await self.client.loop.run_in_executor(self.download_executor, self._download, url, transfer)
+
+    def _download(self, url: str, transfer):
+        self.downloads += 1
+        video_id = video_id_of(url)
+        filename = "Fixture {}-{}.{}".format(video_id, video_id, config.YTDL_DOWNLOAD_CODEC)
+        with urlopen(self.server.url(DOWNLOAD_FIXTURE[0], video_id)) as response:
+            with open(config.TEMP_PATH + filename, "wb") as f:
+                while True:
+                    block = response.read(64 * 1024)
+                    if not block:
+                        break
+                    f.write(block)
+                    self.bandwidth.consume(transfer, len(block))
+        return filename
+
+    def shutdown(self):
+        self.info_executor.shutdown(wait=False)
+        self.download_executor.shutdown(wait=False)
+
+
+# ═══ Functions ════════════════════════════════════════════════════════════════════════════════════════════════════════
+def make_fixtures(path: str, duration: float):
+    """ Encodes a sine tone of `duration` seconds into every fixture format that doesn't exist yet. """
+    os.makedirs(path, exist_ok=True)
+    fixtures = [(filename, arguments) for filename, _, _, arguments in FIXTURE_FORMATS.values()]
+    for filename, arguments in fixtures + [DOWNLOAD_FIXTURE]:
+        target = os.path.join(path, filename)
+        if os.path.exists(target):
+            continue
+        subprocess.run(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi",
+             "-i", "sine=frequency=440:duration={}".format(duration), "-ac", "2", "-ar", "48000"]
+            + arguments + ["-y", target], check=True)
+
+
+def video_id_of(url: str):
+    return url[url.find("v=") + 2:][:11]
@@ -0,0 +1,269 @@
+""" Offline benchmark of the Audio cog pipeline. Drives the cog with fake guilds and voice clients and serves
+fixture audio files instead of Youtube, then writes requests per second, stage latencies and memory of every
+scenario into a JSON file. Run it from Maon's directory:
+
+    python3 -m benchmarks.run [--scenarios cold_cache warm_cache ...] [--output results.json]
+"""
+from benchmarks import fakes
+from benchmarks import fixtures
+from benchmarks.scenarios import SCENARIOS
+from datetime import datetime
+from math import inf
+from random import Random
+from time import perf_counter
+import configuration as config
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+
+class Bench:
+    """ One run of a scenario on a fresh Audio cog with its own temp folder and databases. """
+    __slots__ = ["options", "client", "audio", "server", "workspace", "random", "guilds", "requests", "first_requests"]
+
+    def __init__(self, options, loop, server, workspace: str):
+        self.options = options
+        self.server = server
+        self.workspace = workspace
+        self.random = Random(options.seed)
+        self.guilds = []
+        self.requests = 0
+        self.first_requests = {}    # guild_id: seconds its first request was sent
+        use_workspace(workspace)
+
+        # Imported late, the cog has to see the configuration of the workspace
+        from extensions import audio
+        self.client = fakes.FakeBot(loop)
+        self.audio = self.client.cogs["Audio"] = audio.Audio(self.client)
+        self.audio.ytdl.shutdown()
+        self.audio.ytdl = self.audio.info_cache.ytdl = fixtures.LocalExtractor(
+            self.client, server, self.audio.bandwidth, options.song_duration, options.info_latency,
+            max(1, config.DOWNLOAD_WORKERS))
+
+    def new_guilds(self, amount: int):
+        guilds = [fakes.FakeGuild(self.client, self.options.speed) for _ in range(amount)]
+        self.guilds.extend(guilds)
+        return guilds
+
+    def video_ids(self, prefix: str, amount: int):
+        """ Returns `amount` video ids that are 11 characters long like the ones of Youtube. """
+        return ["{}{:0>{}}".format(prefix[:5], i, 11 - len(prefix[:5])) for i in range(amount)]
+
+    def prefill(self, video_ids):
+        """ Puts `video_ids` into the cache as if they had been downloaded before. """
+        source = os.path.join(self.server.path, fixtures.DOWNLOAD_FIXTURE[0])
+        for video_id in video_ids:
+            if self.audio.catalog.get(video_id) is not None:
+                continue
+            filename = "Fixture {}-{}.{}".format(video_id, video_id, config.YTDL_DOWNLOAD_CODEC)
+            shutil.copyfile(source, config.TEMP_PATH + filename)
+            self.audio.cache.add(video_id, filename, "Fixture " + video_id, os.path.getsize(config.TEMP_PATH + filename),
+                                 self.options.song_duration, config.YTDL_DOWNLOAD_CODEC)
+
+    async def request_all(self, guild, video_ids):
+        """ Sends a play command for every video at once, like listeners who don't wait for each other. """
+        await asyncio.gather(*[self.request(guild, video_id) for video_id in video_ids])
+
+    async def request(self, guild, video_id: str):
+        self.requests += 1
+        self.first_requests.setdefault(guild.id, perf_counter())
+        await self.audio.play.callback(self.audio, guild.message(), url="https://www.youtube.com/watch?v=" + video_id)
+
+    def completed(self):
+        return sum(len(guild.text_channel.now_playing) for guild in self.guilds)
+
+    async def wait(self, timeout: float):
+        """ Waits until every requested song started playing or `timeout` seconds passed. """
+        deadline = perf_counter() + timeout
+        while (self.completed() < self.requests) and (perf_counter() < deadline):
+            await asyncio.sleep(0.02)
+
+    async def close(self):
+        self.audio.cog_unload()
+        await self.audio.unload_task
+        shutil.rmtree(self.workspace, ignore_errors=True)
+
+
+# ═══ Functions ════════════════════════════════════════════════════════════════════════════════════════════════════════
+async def run_scenario(name: str, options, server, root: str):
+    from extensions.monitor.registry import metrics
+    metrics.counters.clear()
+    metrics.histograms.clear()
+
+    loop = asyncio.get_event_loop()
+    bench = Bench(options, loop, server, os.path.join(root, name))
+    if options.tracemalloc:
+        tracemalloc.start()
+    start = perf_counter()
+    await SCENARIOS[name](bench)
+    await bench.wait(options.timeout)
+    seconds = perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if options.tracemalloc else None
+    if options.tracemalloc:
+        tracemalloc.stop()
+
+    first_audio = sorted(guild.text_channel.now_playing[0] - bench.first_requests[guild.id]
+                         for guild in bench.guilds if guild.text_channel.now_playing)
+    result = {
+        "scenario": name,
+        "guilds": len(bench.guilds),
+        "requests": bench.requests,
+        "completed": bench.completed(),
+        "seconds": seconds,
+        "requests_per_second": bench.completed() / seconds if seconds > 0 else None,
+        "guild_first_audio": percentiles(first_audio),
+        "time_to_first_audio": trace_summaries(bench.audio.traces),
+        "stages": stage_summaries(metrics),
+        "cache": {
+            "hits": bench.audio.cache.hits,
+            "misses": bench.audio.cache.misses,
+            "evictions": metrics.counters.get(("maon_cache_evictions_total", ()), 0),
+            "rejections": metrics.counters.get(("maon_cache_rejections_total", ()), 0),
+            "used_bytes": bench.audio.cache.total_size,
+            "info_lookups": bench.audio.ytdl.lookups,
+            "downloads": bench.audio.ytdl.downloads
+        },
+        "memory": memory_usage(peak)
+    }
+    await bench.close()
+    return result
+
+
+def percentiles(values):
+    """ p50, p95, p99 and the maximum of the sorted `values`, None if there are none. """
+    from extensions.monitor.tracing import percentile
+    if not values:
+        return None
+    return {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95),
+            "p99": percentile(values, 99), "max": values[-1]}
+
+
+def trace_summaries(traces):
+    from extensions.monitor import tracing
+    summaries = {}
+    for path in tracing.PATHS:
+        summary = traces.summary(path)
+        if summary is not None:
+            summaries[path] = dict(zip(["count", "p50", "p95", "p99"], summary))
+            summaries[path]["stages"] = dict(traces.stage_medians(path))
+    return summaries
+
+
+def stage_summaries(metrics):
+    """ Count, mean and the bucket bounds the p50 and p95 of every timed stage fall into. """
+    from extensions.monitor.registry import BUCKETS
+    stages = {}
+    for (name, labels), (buckets, total, count) in metrics.histograms.items():
+        if (name != "maon_stage_seconds") or (count == 0):
+            continue
+        summary = {"count": count, "mean": total / count}
+        for p in [50, 95]:
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, buckets):
+                cumulative += bucket
+                if cumulative >= p / 100 * count:
+                    summary["p{}_at_most".format(p)] = bound if bound != inf else None
+                    break
+        stages[dict(labels).get("stage")] = summary
+    return stages
+
+
+def memory_usage(peak):
+    """ Peak of the Python heap if it was traced, max resident size of Maon and of the FFmpeg processes it ran. """
+    usage = {"python_peak_bytes": peak}
+    if resource is not None:
+        # Linux reports kilobytes, macOS bytes
+        unit = 1 if sys.platform == "darwin" else 1024
+        usage["max_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+        usage["children_max_rss_bytes"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit
+    return usage
+
+
+def use_workspace(path: str):
+    """ Points every path of the configuration into `path` and turns off what doesn't belong into a benchmark. """
+    config.MUSIC_PATH = os.path.join(path, "music") + "/"
+    config.SFX_PATH = os.path.join(path, "sfx") + "/"
+    config.TEMP_PATH = os.path.join(path, "cache") + "/"
+    config.DATA_PATH = os.path.join(path, "data") + "/"
+    config.SONG_CATALOG_PATH = config.DATA_PATH + "song_catalog.db"
+    config.INFO_CACHE_PATH = config.DATA_PATH + "info_cache.db"
+    config.LIBRARY_PATH = config.DATA_PATH + "library/"
+    config.LIBRARY_INDEX_PATH = config.DATA_PATH + "library.db"
+    config.SFX_BANK_PATH = config.DATA_PATH + "sfx_bank/"
+    config.PLAY_HISTORY_PATH = config.DATA_PATH + "play_history.db"
+    config.LIBRARY_BUILD_ON_START = False
+    config.WARMING_HOURS = None
+    for folder in [config.MUSIC_PATH, config.SFX_PATH, config.TEMP_PATH, config.DATA_PATH]:
+        os.makedirs(folder, exist_ok=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(options):
+    root = tempfile.mkdtemp(prefix="maon-bench-")
+    fixture_path = os.path.join(root, "fixtures")
+    fixtures.make_fixtures(fixture_path, options.song_duration)
+    server = fixtures.FixtureServer(fixture_path)
+
+    results = []
+    try:
+        for name in options.scenarios:
+            print("[Bench] Running {}...".format(name))
+            result = await run_scenario(name, options, server, root)
+            results.append(result)
+            print("[Bench] {}: {}/{} songs started in {:.2f}s, {:.1f} requests/s".format(
+                name, result["completed"], result["requests"], result["seconds"], result["requests_per_second"] or 0))
+    finally:
+        server.close()
+        shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "options": vars(options)
+        },
+        "scenarios": results
+    }
+    os.makedirs(os.path.dirname(options.output) or ".", exist_ok=True)
+    with open(options.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("[Bench] Results written to {}".format(options.output))
+
+
+def parse_options(args=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the Audio cog pipeline.")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--output", default="benchmarks/results/{}.json".format(datetime.now().strftime("%Y%m%d-%H%M%S")))
+    parser.add_argument("--song-duration", type=float, default=3.0, help="Seconds of the fixture songs.")
+    parser.add_argument("--info-latency", type=float, default=0.05, help="Seconds a simulated video lookup takes.")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="How many times faster than real time songs play, 0 for as fast as possible.")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Seconds a scenario may take.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tracemalloc", action="store_true", help="Trace the Python heap, slows the run down.")
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main(parse_options()))
@@ -0,0 +1,49 @@
+import asyncio
+
+
+# ═══ Functions ════════════════════════════════════════════════════════════════════════════════════════════════════════
+async def cold_cache(bench):
+    """ 10 guilds request 2 different songs each, none of them is cached. """
+    guilds = bench.new_guilds(10)
+    videos = bench.video_ids("cold", 20)
+    await asyncio.gather(*[bench.request_all(guild, videos[i * 2:i * 2 + 2]) for i, guild in enumerate(guilds)])
+
+
+async def warm_cache(bench):
+    """ The same load as the cold cache, but every song is in the cache already. """
+    videos = bench.video_ids("warm", 20)
+    bench.prefill(videos)
+    guilds = bench.new_guilds(10)
+    await asyncio.gather(*[bench.request_all(guild, videos[i * 2:i * 2 + 2]) for i, guild in enumerate(guilds)])
+
+
+async def same_video_burst(bench):
+    """ 50 guilds request the same uncached song at the same moment, it should only be looked up and cached once. """
+    video = bench.video_ids("burst", 1)[0]
+    await asyncio.gather(*[bench.request_all(guild, [video]) for guild in bench.new_guilds(50)])
+
+
+async def mixed_load(bench):
+    """ 100 guilds request 3 songs each: cached songs, uncached songs and one hot song most of them want. """
+    cached = bench.video_ids("cached", 30)
+    uncached = bench.video_ids("uncached", 100)
+    hot = bench.video_ids("hot", 1)
+    bench.prefill(cached)
+
+    requests = []
+    for guild in bench.new_guilds(100):
+        videos = []
+        for _ in range(3):
+            roll = bench.random.random()
+            pool = cached if roll < 0.5 else (uncached if roll < 0.8 else hot)
+            videos.append(bench.random.choice(pool))
+        requests.append(bench.request_all(guild, videos))
+    await asyncio.gather(*requests)
+
+
+SCENARIOS = {
+    "cold_cache": cold_cache,
+    "warm_cache": warm_cache,
+    "same_video_burst": same_video_burst,
+    "mixed_load": mixed_load
+}
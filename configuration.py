@@ -10,15 +10,44 @@ MUSIC_PATH = "./music/"
 SFX_PATH = "./sfx/"
 DOWNLOADS_PATH = "./downloads/"
 TEMP_PATH = "./music/.Cached Songs/"
+DATA_PATH = "./data/"
+SONG_CATALOG_PATH = DATA_PATH + "song_catalog.db"   # Index of the songs in the temp folder
+INFO_CACHE_PATH = DATA_PATH + "info_cache.db"       # Video meta data that survives restarts
+LIBRARY_PATH = DATA_PATH + "library/"               # Playback ready Opus copies of the music folder
+LIBRARY_INDEX_PATH = DATA_PATH + "library.db"
+LIBRARY_BUILD_ON_START = True                       # Transcode new or changed songs of the music folder on startup
+SFX_BANK_PATH = DATA_PATH + "sfx_bank/"             # Pre-decoded sound effects
+PLAY_HISTORY_PATH = DATA_PATH + "play_history.db"   # Decaying play counts that decide which songs get cached
 
 TEMP_FOLDER_MAX_SIZE_IN_MB = 512
+PLAY_HISTORY_SIZE = 4096                # How many videos the play history remembers, the least played are forgotten
+PLAY_HISTORY_HALF_LIFE = 14 * 86400     # Seconds until a play counts only half as much for caching decisions
+WARMING_HOURS = (3, 8)                  # Hours of the day (from, to) evicted favourites are downloaded again, None to disable
+WARMING_INTERVAL = 1800                 # Seconds between checks for songs to download again during those hours
+WARMING_BATCH = 5                       # How many songs get downloaded again per check
+WARMING_MIN_PLAYS = 2                   # How many recent plays a song needs to be downloaded again
 
 # Audio Settings:
 SFX_VOLUME = 0.3            # Volume of special effects
+CROSSFADE_TIME = 0.0        # Seconds songs fade into each other, 0 switches without a gap but without a fade
+FADE_OUT_TIME = 0.5         # Seconds a song fades out when it gets skipped or stopped
+VOLUME_FADE_SPEED = 1.0     # Seconds a volume change from 0% to 100% takes
+SFX_WATCH_INTERVAL = 5      # Seconds between checks of the sfx folder for new, changed, renamed or removed sound effects
 PLAYER_TIMEOUT = 7200       # Seconds until Maon disconnects from a voice channel without any interaction
+EMPTY_CHANNEL_TIMEOUT = 10  # Seconds until Maon leaves a voice channel everyone else left
 SONG_DURATION_MAX = 600     # How long songs can be in seconds to be downloaded and stored locally
 
-DOWNLOAD_RATE_LIMITER = "3M"    # Limit the bandwith when Maon downloads songs (e.g. 3M for 3 MegabBytes / s)
+DOWNLOAD_RATE_LIMITER = "3M"    # Bandwidth all downloads and cached streams share (e.g. 3M for 3 MegaBytes / s), None for no limit
+DOWNLOAD_WORKERS = 2            # How many songs can be downloaded and transcoded at the same time
+STREAM_WHILE_CACHING = True     # Play short songs right away and cache them while they play instead of downloading first
+PREFETCH_DEPTH = 3              # How many upcoming songs of a playlist get prepared ahead of time
+PREFETCH_REFRESH_MARGIN = 300   # Seconds before a stream url expires that it gets refreshed
+PREFETCH_DOWNLOADS = True       # Download upcoming short songs into the cache before they play
+OPUS_PASSTHROUGH = True         # Pass Opus songs through without re-encoding them while the volume is at 100%
+LOUDNESS_TARGET = -14.0         # Loudness in LUFS cached and prepared songs are leveled to
+LOUDNESS_MAX_GAIN = 6.0         # Maximum dB quiet songs get amplified by
+SILENCE_THRESHOLD = -50         # Volume in dB below which the start and end of a song count as silence
+SILENCE_MIN_DURATION = 0.1      # Seconds of silence at the start or end of a song before it gets cut off
 
 # Activity Texts:
 STATUS_TEXT_LISTENING_TO = [
@@ -69,23 +98,25 @@ DEFAULT_REPLY = [
 ]
 
 # Audioplayer Settings:
-AUDIO_DOWNLOAD_CMD_DEFAULT = [
-    "youtube-dl", 
-    "--extract-audio", 
-    "--audio-format",
-    "mp3", 
-    "--audio-quality",
-    "192K",
-    "--prefer-ffmpeg",
-    "-o",
-    TEMP_PATH[2:] + "%(title)s-%(id)s.%(ext)s",
-    "-f",
-    "format id goes into 10",
-    "url goes into 11", 
-    "--limit-rate",
-    DOWNLOAD_RATE_LIMITER
+YTDL_DOWNLOAD_CODEC = "opus"        # Youtube's format 251 already is Opus and only gets copied into an Ogg file
+YTDL_DOWNLOAD_OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+    'outtmpl': TEMP_PATH + "%(title)s-%(id)s.%(ext)s",
+    'prefer_ffmpeg': True,
+    'postprocessors': [{
+        'key': 'FFmpegExtractAudio',
+        'preferredcodec': YTDL_DOWNLOAD_CODEC,
+        'preferredquality': '128'
+    }],
+    'source_address': '0.0.0.0'
+}
+YTDL_INFO_THREADS = 2       # Threads looking up video meta data, downloads get one thread per download worker
 
-]
+INFO_CACHE_MEMORY_SIZE = 512        # Video meta data entries kept in memory
+INFO_CACHE_TTL = 6 * 3600           # Seconds until cached video meta data is looked up again
+INFO_CACHE_EXPIRY_MARGIN = 900      # Seconds before its stream urls expire that meta data gets dropped
+INFO_CACHE_NEGATIVE_TTL = 60        # Seconds a failed lookup (private / removed video) is remembered
 
 BEFORE_ARGS = "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 10"
 FFMPEG_OPTIONS = {'options': '-vn'}
@@ -97,6 +128,7 @@ YTDL_INFO_OPTIONS = {
 }
 
 PLAYLIST_MSG_MAX_LEN = 20
+PLAYLIST_IMPORT_MAX_LEN = 500   # How many videos of a Youtube playlist get added to the queue at most
 
 # Web Settings:
 RFC_3986_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~:/?#[]@!$&'()*+,;=%"
@@ -122,7 +154,12 @@ EMOJI_LIST = [
 
 # Maon's Extensions:
 EXTENSION_PATH = "extensions." # Use . instead of / for folders as required by Discord.py
-EXTENSION_LIST = ["admin", "audio", "basic", "errormanager", "filebrowser", "fun"]
+EXTENSION_LIST = ["admin", "audio", "basic", "errormanager", "filebrowser", "fun", "metrics"]
+
+# Metrics:
+METRICS_HOST = "127.0.0.1"  # Interface the Prometheus metrics are served on, keep it local
+METRICS_PORT = 9464         # Port of http://<host>:<port>/metrics, remove "metrics" from the extensions to disable it
+TRACE_WINDOW = 500          # How many of the last play requests per path the stats command looks at
 
 # Help Command Embed:
 COMMANDLIST_EMBED_PREP_START = "Prefix: " + PREFIX[0] + " (case insensitive)\n\n"
@@ -134,6 +171,8 @@ COMMANDLIST_EMBED_ADMIN_PREP = [
     ":white_small_square: " + PREFIX[0] + "remove <number> - Removes messages in the channel.\n",
     ":white_small_square: " + PREFIX[0] + "status <listening/playing/watching> <status> - Sets Maon's status.\n",
     ":white_small_square: " + PREFIX[0] + "status cancel - Cancels Maon's looping status updates.\n",
+    ":white_small_square: " + PREFIX[0] + "library - Transcodes the music folder into the playback ready library.\n",
+    ":white_small_square: " + PREFIX[0] + "stats - Shows how long play requests take until the music starts and what the downloads do.\n",
     "\n"
 ]
 
@@ -154,10 +193,12 @@ COMMANDLIST_EMBED_MUSIC_PREP = [
     ":white_small_square: " + PREFIX[0] + "play <link / filepath / filename> - Plays a Youtube video or local file.\n",
     ":white_small_square: " + PREFIX[0] + "sfx <filepath / filename> - Plays a local sound effect.\n",
     ":white_small_square: " + PREFIX[0] + "playlist - Displays the current playlist.\n",
-    ":white_small_square: " + PREFIX[0] + "playlist <1 - 20> - Puts an entry to the front.\n",
+    ":white_small_square: " + PREFIX[0] + "playlist page <number> - Displays later pages of the playlist.\n",
+    ":white_small_square: " + PREFIX[0] + "playlist shuffle - Shuffles the playlist.\n",
+    ":white_small_square: " + PREFIX[0] + "playlist <number> - Puts an entry to the front.\n",
     ":white_small_square: " + PREFIX[0] + "playlist remove - Clears the playlist.\n",
-    ":white_small_square: " + PREFIX[0] + "playlist remove <1 - 20> - Removes a song from the playlist.\n",
-    ":white_small_square: " + PREFIX[0] + "playlist copy <1 - 20> - Copies a track and inserts it at the beginning.\n",
+    ":white_small_square: " + PREFIX[0] + "playlist remove <number> - Removes a song from the playlist.\n",
+    ":white_small_square: " + PREFIX[0] + "playlist copy <number> - Copies a track and inserts it at the beginning.\n",
     ":white_small_square: " + PREFIX[0] + "stop - Turns off the music player and makes Maon leave.\n",
     ":white_small_square: " + PREFIX[0] + "skip - Skips the current song.\n",
     ":white_small_square: " + PREFIX[0] + "loop <song / playlist / off> - Loops the current song or playlist.\n",
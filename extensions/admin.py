@@ -181,6 +181,9 @@ class Admin(commands.Cog):
         """ Empties the music cache folder. """
         if path.exists(config.TEMP_PATH):
             rmtree(config.TEMP_PATH)
+        audio = self.client.get_cog("Audio")
+        if audio is not None:
+            audio.cache.clear()
         return await message.send("Temp folder has been scrubbed.")
 
     @commands.command()
@@ -1,82 +1,154 @@
 import os.path
 import asyncio
-import subprocess
 import configuration as config
 from discord import Embed
 from discord.ext import commands
+from extensions.player import analysis
 from extensions.player import audioplayer
-from youtube_dl import YoutubeDL
+from extensions.player import bandwidth
+from extensions.player import cachemanager
+from extensions.player import cachewarmer
+from extensions.player import downloadworker
+from extensions.player import infocache
+from extensions.player import library
+from extensions.player import playhistory
+from extensions.player import presence
+from extensions.player import sfxbank
+from extensions.player import sfxregistry
+from extensions.player import songcatalog
+from extensions.player import sources
+from extensions.player import track as tracks
+from extensions.player import ytdlengine
+from extensions.monitor import tracing
+from extensions.monitor.registry import metrics
+from youtube_dl.downloader.common import FileDownloader
 from youtube_dl.utils import DownloadError
+from youtube_dl.utils import sanitize_filename
 from tinytag import TinyTag, TinyTagException
-from time import sleep
-from time import time
-from pathlib import Path
-from os import listdir
 
 
 class Audio(commands.Cog):
-    __slots__ = ["client", "players", "cached_songs", "running",
-                "info_queue", "info_task", "download_queue", "download_task", "cache_queue",
-                "cache_task", "track_queue", "track_task"]
+    __slots__ = ["client", "players", "catalog", "cache", "bandwidth", "ytdl", "info_cache", "in_flight", "tees",
+                "music_library", "sfx_bank", "sfx_registry", "presence", "warmer", "traces", "running",
+                "info_queue", "info_task", "download_queue", "download_workers", "cache_queue",
+                "cache_task", "track_queue", "track_task", "background_tasks", "unload_task"]
 
     def __init__(self, client):
         self.client = client
         self.players = {}
-        self.cached_songs = {}
+        self.catalog = songcatalog.SongCatalog(config.SONG_CATALOG_PATH, config.TEMP_PATH)
+        history = playhistory.PlayHistory(config.PLAY_HISTORY_PATH, config.PLAY_HISTORY_HALF_LIFE, config.PLAY_HISTORY_SIZE)
+        self.cache = cachemanager.CacheManager(
+            self.client, self.catalog, history, config.TEMP_PATH, config.TEMP_FOLDER_MAX_SIZE_IN_MB * 1024 * 1024)
         self.running = True
+        self.background_tasks = set()   # Analyses and library builds nobody awaits, cancelled on unload
+        self.unload_task = None
+        self.bandwidth = bandwidth.BandwidthScheduler(
+            FileDownloader.parse_bytes(config.DOWNLOAD_RATE_LIMITER) if config.DOWNLOAD_RATE_LIMITER else None)
+        self.ytdl = ytdlengine.YTDLEngine(
+            self.client, self.bandwidth, config.YTDL_INFO_THREADS, max(1, config.DOWNLOAD_WORKERS))
+        self.info_cache = infocache.InfoCache(self.ytdl, config.INFO_CACHE_PATH, config.INFO_CACHE_MEMORY_SIZE)
+        self.in_flight = {}     # video_id: future of the track that is being prepared
+        self.traces = tracing.TraceStats(config.TRACE_WINDOW)
+        self.tees = set()       # video_ids that are being written into the cache while they play
+        self.music_library = library.MusicLibrary(self.client, config.MUSIC_PATH, config.LIBRARY_PATH, config.LIBRARY_INDEX_PATH)
+        if config.LIBRARY_BUILD_ON_START:
+            self.background_task(self.music_library.build())
+        self.sfx_bank = sfxbank.SfxBank(self.client, config.SFX_PATH, config.SFX_BANK_PATH)
+        # The registry rebuilds the sfx bank whenever the sfx folder changes, starting with its first scan
+        self.sfx_registry = sfxregistry.SfxRegistry(
+            self.client, config.SFX_PATH, config.SFX_WATCH_INTERVAL, on_change=self.sfx_bank.build)
+        self.presence = presence.VoicePresence(self.client, config.EMPTY_CHANNEL_TIMEOUT, self.channel_emptied)
         self.info_queue = asyncio.Queue()
         self.info_task = self.client.loop.create_task(self.info_loop())
         self.download_queue = asyncio.Queue()
-        self.download_task = self.client.loop.create_task(self.download_loop())
+        self.download_workers = [
+            downloadworker.DownloadWorker(self.client, self, i) for i in range(max(1, config.DOWNLOAD_WORKERS))]
         self.cache_queue = asyncio.Queue()
         self.cache_task = self.client.loop.create_task(self.cache_loop())
         self.track_queue = asyncio.Queue()
         self.track_task = self.client.loop.create_task(self.track_loop())
+        self.warmer = cachewarmer.CacheWarmer(self.client, self, config.WARMING_INTERVAL, config.WARMING_HOURS,
+                                              config.WARMING_BATCH, config.WARMING_MIN_PLAYS)
+        # Songs cached before the analysis existed get analyzed in the background
+        self.background_task(self.analyze_backlog())
 
     async def prep_link_track(self, message, url: str):
-        """ Looks up the requested `url` in the cached_songs dictionary to see if the track exists in the
+        """ Looks up the requested `url` in the song catalog to see if the track exists in the
         temp folder. If not, starts the download / streaming process. """
+        trace = tracing.Trace()
         # All we know at this point is the url and who requested it. Get the video_id from the url.
         video_id = await get_video_id(url)
         if video_id is None:
             return await message.send("That link looks invalid to me.")
+        trace.label = video_id
         
-        # Look up video_id in cached_songs dictionary and build a track if an entry exists.
-        filename = self.cached_songs.get(video_id)
-        if (filename is not None) and (os.path.exists(config.TEMP_PATH + filename)):
-            track_title = filename[:len(filename) - 16]
-            track_url = config.TEMP_PATH + filename
-            track = {"title": track_title, "url": track_url, "track_type": "music", "message": message}
-
-            await self.track_queue.put(track)
+        # Look up video_id in the song catalog and build a track if an entry exists.
+        entry = self.get_cached_song(video_id)
+        if entry is not None:
+            self.cache.touch(video_id)
+            track_url = config.TEMP_PATH + entry.get("filename")
+            trace.path = "cache_hit"
+            trace.mark("lookup")
+            track = tracks.Track(entry.get("title"), track_url, "music", video_id=video_id, trace=trace,
+                                 **analysis.playback_options(entry), **tracks.requested_by(message))
+
+            await self.track_queue.put((message, track))
         
+        elif video_id in self.in_flight:
+            # Someone else already requested the video and it is on its way, wait for it instead of preparing it twice.
+            track = await asyncio.shield(self.in_flight[video_id])
+            if track is None:
+                return await message.channel.send("I couldn't get that video ready... maybe try again in a few seconds.")
+            track = track.copy(message)
+            track.cache_to = None     # Only the first requester writes the stream into the cache
+            trace.path = "download" if track.track_type == "music" else "stream"
+            trace.mark("wait")
+            track.trace = trace
+            await self.track_queue.put((message, track))
+
         else: # Track is not in temp folder, hand it over to info_queue and start the downloading or streaming process.
             url = "https://www.youtube.com/watch?v=" + video_id
-            req = {"message": message, "url": url, "video_id": video_id}
+            trace.mark("lookup")
+            req = {"message": message, "url": url, "video_id": video_id, "trace": trace,
+                   "future": self.client.loop.create_future()}
+            self.in_flight[video_id] = req.get("future")
             return await self.info_queue.put(req)
 
 
     async def prep_local_track(self, message, url: str):
         """ Builds local track information for the audioplayer. """
+        trace = tracing.Trace("local", url)
         tag = TinyTag.get(config.MUSIC_PATH + url)
         if tag.title is None:
             tag.title = url
-        track = {"title": tag.title, "url": config.MUSIC_PATH + url, "track_type": "music", "message": message}
-        return await self.track_queue.put(track)
+        # Prefer the transcoded copy of the music library if it is up to date
+        prepared = self.music_library.get(config.MUSIC_PATH + url)
+        track_url = prepared.get("path") if prepared is not None else (config.MUSIC_PATH + url)
+        trace.mark("lookup")
+        track = tracks.Track(tag.title, track_url, "music", trace=trace, **analysis.playback_options(prepared),
+                             **tracks.requested_by(message))
+        return await self.track_queue.put((message, track))
 
 
     async def track_loop(self):
-        """ Centralizes the queuing of tracks in this task. Will turn this loop into a function instead later. """
+        """ Centralizes the queuing of tracks in this task. Will turn this loop into a function instead later.
+        Tracks come in together with the message that requested them, only the track is queued. """
         try:
             while self.running:
-                track = await self.track_queue.get()
-                message = track.get("message")
-
-                if message.guild.id not in self.players:
-                    self.players[message.guild.id] = audioplayer.AudioPlayer(self.client, message)
-                await self.players[message.guild.id].queue.put(track)
-                if message.guild.voice_client.is_playing() or message.guild.voice_client.is_paused():
-                    await message.channel.send("{} has been added to the queue.".format(track.get("title")))
+                message, track = await self.track_queue.get()
+                with metrics.timed("maon_stage_seconds", stage="track"):
+                    tracing.mark(track.trace, "track")
+                    queued = message.guild.voice_client.is_playing() or message.guild.voice_client.is_paused()
+                    if queued:
+                        # The track waits for the songs before it, that isn't time it took to get ready
+                        track.trace = None
+                    if message.guild.id not in self.players:
+                        self.players[message.guild.id] = audioplayer.AudioPlayer(self.client, message)
+                    self.players[message.guild.id].queue.put(track)
+                    self.players[message.guild.id].prefetcher.notify()
+                    if queued:
+                        await message.channel.send("{} has been added to the queue.".format(track.title))
         
         except (asyncio.CancelledError, asyncio.TimeoutError):
             pass
@@ -88,71 +160,85 @@ class Audio(commands.Cog):
         try:
             while self.running:
                 req = await self.info_queue.get()
-                message = req.get("message")
-                # Find out if the video is a normal video or live stream.
-                # If it's a video longer than 15 minutes, maybe also stream it?
-                video_info = {}
+                downloading = False
                 try:
-                    video_info = await self.client.loop.run_in_executor(
-                        None, lambda: YoutubeDL(config.YTDL_INFO_OPTIONS).extract_info(req.get("url"), download=False))
-                except DownloadError:
-                    await message.channel.send("I could not download the video's meta data... maybe try again in a few seconds.")
-                    continue
-
-                # Find out if the video is a live stream or is longer than n seconds (config)
-                # Stream it if yes, preload would take too long.
+                    message = req.get("message")
+                    # Find out if the video is a normal video or live stream.
+                    # If it's a video longer than 15 minutes, maybe also stream it?
+                    video_info = {}
+                    try:
+                        with metrics.timed("maon_stage_seconds", stage="info"):
+                            video_info = await self.info_cache.extract_info(req.get("video_id"), req.get("url"))
+                        tracing.mark(req.get("trace"), "info")
+                    except DownloadError:
+                        self.finish_request(req, None)
+                        await message.channel.send("I could not download the video's meta data... maybe try again in a few seconds.")
+                        continue
+
+                    # Find out if the video is a live stream or is longer than n seconds (config)
+                    # Stream it if yes, preload would take too long.
                 
-                # Check if normal video has its duration stripped, sometimes this occures.
-                if (video_info.get("protocol") is None) and (video_info.get("duration") is None):
-                    video_info["duration"] = config.SONG_DURATION_MAX
-
-                if video_info.get("protocol") or (video_info.get("duration") >= config.SONG_DURATION_MAX) or (config.SONG_DURATION_MAX == 0):
-                    track = {
-                        "title": video_info.get("title"), 
-                        "url": video_info.get("url"), 
-                        "track_type": "stream", 
-                        "message": message, 
-                        "original_url": req.get("url"), 
-                        "video_info": video_info,
-                        "time_stamp": time()
-                    }
-                    if (video_info.get("duration") >= config.SONG_DURATION_MAX):
+                    # Check if normal video has its duration stripped, sometimes this occures.
+                    if (video_info.get("protocol") is None) and (video_info.get("duration") is None):
+                        video_info["duration"] = config.SONG_DURATION_MAX
+                    req["title"] = video_info.get("title")
+                    req["duration"] = video_info.get("duration")
+
+                    if is_long_video(video_info):
+                        track = self.stream_track(req, video_info)
+                        self.finish_request(req, track)
+                        await self.track_queue.put((message, track))
+
+                    else:
+                        # It's a normal short video
+                        # Get the best audio format id and attach it to the request
                         formats = video_info.get("formats", [video_info])
+                        format_ids = []
                         for f in formats:
-                            if f.get("format_id") == "251":
-                                track["url"] = f.get("url")
-                                break
-                    await self.track_queue.put(track)
-
-                else:
-                    # It's a normal short video
-                    # Get the best audio format id and attach it to the request
-                    formats = video_info.get("formats", [video_info])
-                    req["formats"] = formats
-                    format_ids = []
-                    for f in formats:
-                        format_ids.append(f['format_id'])
-                    if "251" in format_ids:
-                        req["format_id"] = "251"
-                        try:
-                            await self.manage_temp_size(req)
-                        except OSError as e:
-                            print(e)
-                            await message.channel.send("The requested download is larger than what I'm allowed to have, defaulting to stream.")
-                            await self.track_rescue(req, video_info)
+                            format_ids.append(f['format_id'])
+                        if config.STREAM_WHILE_CACHING:
+                            req["format_id"] = "251" if "251" in format_ids else "140"
+                            await self.stream_while_caching(req, video_info)
                             continue
-                    else:
-                        req["format_id"] = "140"
-                        try:
-                            await self.manage_temp_size(req)
-                        except OSError as e:
-                            print(e)
-                            await message.channel.send("The requested download is larger than what I'm allowed to have, defaulting to stream.")
+
+                        # Songs that aren't played often enough to be cached are only streamed
+                        format_id = "251" if "251" in format_ids else "140"
+                        if not self.cache.admit(req.get("video_id"), format_filesize(formats, format_id)):
                             await self.track_rescue(req, video_info)
                             continue
 
-                    await message.channel.send("Preparing {}...".format(video_info.get("title")))
-                    await self.download_queue.put(req)
+                        if "251" in format_ids:
+                            req["format_id"] = "251"
+                            try:
+                                await self.manage_temp_size(req, format_filesize(formats, req["format_id"]))
+                            except OSError as e:
+                                print(e)
+                                await message.channel.send("The requested download is larger than what I'm allowed to have, defaulting to stream.")
+                                await self.track_rescue(req, video_info)
+                                continue
+                        else:
+                            req["format_id"] = "140"
+                            try:
+                                await self.manage_temp_size(req, format_filesize(formats, req["format_id"]))
+                            except OSError as e:
+                                print(e)
+                                await message.channel.send("The requested download is larger than what I'm allowed to have, defaulting to stream.")
+                                await self.track_rescue(req, video_info)
+                                continue
+
+                        if req.get("trace") is not None:
+                            req.get("trace").path = "download"
+                        tracing.mark(req.get("trace"), "reserve")
+                        await message.channel.send("Preparing {}...".format(video_info.get("title")))
+                        await self.download_queue.put(req)
+                        downloading = True
+                except Exception as e:
+                    print("[Audio] Preparing {} failed: {}".format(req.get("url"), e))
+                    self.cache.release(req.get("reserved_size", 0))
+                finally:
+                    # Everyone waiting for the video is told if the request went nowhere, a download resolves it later
+                    if not downloading:
+                        self.finish_request(req, None)
 
         except (asyncio.CancelledError, asyncio.TimeoutError):
             pass
@@ -160,108 +246,274 @@ class Audio(commands.Cog):
     async def track_rescue(self, req, video_info):
         """ Creates a track of streaming type for the player as a fallback solution if the meta data
         obtained from Youtube is faulty for download. """
-        message = req.get("message")
-        track = {
-            "title": video_info.get("title"), 
-            "url": video_info.get("url"), 
-            "track_type": "stream", 
-            "message": message, 
-            "original_url": req.get("url"), 
-            "video_info": video_info,
-            "time_stamp": time()
-        }
-        formats = video_info.get("formats", [video_info])
-        for f in formats:
-            if f["format_id"] == "251":
-                track["url"] = f.get("url")
-        await self.track_queue.put(track)
-
-    async def manage_temp_size(self, req):
-        """ Removes items from the temp folder in FIFO order if a new addition would go over the 
-        max-size stated in the configuration file """
+        track = self.stream_track(req, video_info)
+        self.finish_request(req, track)
+        await self.track_queue.put((req.get("message"), track))
+
+    async def stream_while_caching(self, req, video_info):
+        """ Queues a short video as a stream right away. The player copies the stream into the temp folder while
+        it plays and the song is added to the cache once the stream completed. """
+        track = self.caching_stream_track(req, video_info)
+        self.finish_request(req, track)
+        await self.track_queue.put((req.get("message"), track))
+
+    def stream_track(self, req, video_info, format_id: str = "251"):
+        """ Builds a stream track of the requested video, playing format `format_id` if the video has it and its
+        best audio format otherwise. """
+        f = infocache.stream_format(video_info, format_id)
+        if f is not None:
+            url, opus, format_id = f.get("url"), f.get("acodec") == "opus", f.get("format_id")
+        else:
+            url, opus, format_id = video_info.get("url"), False, None
+        if req.get("trace") is not None:
+            req.get("trace").path = "stream"
+        return tracks.Track(video_info.get("title"), url, "stream", video_id=req.get("video_id"),
+                            original_url=req.get("url"), opus=opus, format_id=format_id, trace=req.get("trace"),
+                            **tracks.requested_by(req.get("message")))
+
+    def caching_stream_track(self, req, video_info):
+        """ Builds a stream track of a short video that the player writes into the cache while it plays. """
+        track = self.stream_track(req, video_info, req.get("format_id"))
+        for f in video_info.get("formats", [video_info]):
+            if (track.format_id is not None) and (f.get("format_id") == track.format_id):
+                # Opus gets copied into an Ogg file that can be passed through later, other codecs keep their container
+                ext = "opus" if track.opus else f.get("ext")
+                name = "{}-{}".format(sanitize_filename(video_info.get("title")), req.get("video_id"))
+                track.cache_to = {
+                    "video_id": req.get("video_id"),
+                    "title": video_info.get("title"),
+                    "duration": video_info.get("duration"),
+                    "filename": "{}.{}".format(name, ext),
+                    "part_name": "{}.part.{}".format(name, ext),
+                    "format": ext,
+                    "format_id": f.get("format_id"),
+                    "filesize": f.get("filesize") or 0
+                }
+                break
+        return track
+
+    async def resolve_entry(self, track):
+        """ Turns an entry of an imported playlist into a playable track right before it is needed. The entry is
+        updated in place. Copies of it in the queue are separate tracks and get resolved when they come up
+        themselves. Returns False if the video can't be played. """
+        if track.track_type != "entry":
+            return True
+        video_id = track.video_id
+        entry = self.get_cached_song(video_id)
+        if entry is not None:
+            track.url = config.TEMP_PATH + entry.get("filename")
+            track.track_type = "music"
+            for name, value in analysis.playback_options(entry).items():
+                setattr(track, name, value)
+            return True
+
         try:
-            size_in_mb = (sum(f.stat().st_size for f in Path(config.TEMP_PATH).glob('**/*') if f.is_file())) / (1024 * 1024)
-            filesize_in_mb = 0
-            for f in req.get("formats"):
-                if f["format_id"] == req.get("format_id"):
-                    if f.get("filesize"):
-                        filesize_in_mb = (f.get("filesize") / (1024 * 1024))
-                        if filesize_in_mb > config.TEMP_FOLDER_MAX_SIZE_IN_MB:
-                            raise OSError("[Audio Ext] Requested download is larger than the allowed size of the temp folder. ({} > {})".format(filesize_in_mb, config.TEMP_FOLDER_MAX_SIZE_IN_MB))
-                        break
-                    else:
-                        break
-            size_in_mb += filesize_in_mb
-            while (config.TEMP_FOLDER_MAX_SIZE_IN_MB < size_in_mb):
-                first_file = min(Path(config.TEMP_PATH).glob('**/*'), key=os.path.getmtime)
-                size_first_file = os.path.getsize(first_file)
-                os.remove(first_file)
-                size_in_mb -= size_first_file
-        except ValueError:
-            print("[Audio Ext] Temp folder is empty or does not exist.")
-
-    async def download_loop(self):
-        """ Downloads a requested song and stores it in the music cache folder for ease of access and replayability """ 
+            with metrics.timed("maon_stage_seconds", stage="resolve"):
+                video_info = await self.info_cache.extract_info(video_id, track.original_url)
+        except DownloadError:
+            return False
+        req = {"url": track.original_url, "video_id": video_id}
+        if is_long_video(video_info):
+            track.take_over(self.stream_track(req, video_info))
+        elif config.STREAM_WHILE_CACHING:
+            format_ids = [f.get("format_id") for f in video_info.get("formats", [])]
+            req["format_id"] = "251" if "251" in format_ids else "140"
+            track.take_over(self.caching_stream_track(req, video_info))
+        else:
+            track.take_over(self.stream_track(req, video_info))
+        return True
+
+    async def prep_playlist(self, message, playlist_id: str):
+        """ Adds the videos of a Youtube playlist to the queue in one go. Only their ids and titles are looked up
+        here, the player and the prefetcher resolve them shortly before they play. """
         try:
-            while self.running:
-                req = await self.download_queue.get()
-                message = req.get("message")
+            with metrics.timed("maon_stage_seconds", stage="playlist"):
+                entries = await self.ytdl.extract_playlist("https://www.youtube.com/playlist?list=" + playlist_id)
+        except DownloadError:
+            return await message.send("I could not open that playlist... maybe try again in a few seconds.")
+        if not entries:
+            return await message.send("That playlist looks empty to me.")
+
+        entry_tracks = []
+        for e in entries:
+            entry_tracks.append(tracks.Track(e.get("title") or e.get("id"), None, "entry", video_id=e.get("id"),
+                                             original_url="https://www.youtube.com/watch?v=" + e.get("id"),
+                                             **tracks.requested_by(message)))
 
-                command = config.AUDIO_DOWNLOAD_CMD_DEFAULT
-                command[10] = req.get("format_id")
-                command[11] = req.get("url")
+        if message.guild.id not in self.players:
+            self.players[message.guild.id] = audioplayer.AudioPlayer(self.client, message)
+        self.players[message.guild.id].queue.extend(entry_tracks)
+        self.players[message.guild.id].prefetcher.notify()
+        return await message.send("I've added {} songs of the playlist to the queue.".format(len(entry_tracks)))
+
+    async def begin_stream_cache(self, track):
+        """ Reserves room for a stream that is about to be written into the temp folder. Returns the path of the
+        partial file or None if the stream should only be played. """
+        cache_to = track.cache_to
+        video_id = cache_to.get("video_id")
+        if (video_id in self.tees) or (self.catalog.get(video_id) is not None):
+            return None
+        if not self.cache.admit(video_id, cache_to.get("filesize")):
+            return None
+        try:
+            await self.cache.reserve(cache_to.get("filesize"))
+        except OSError as e:
+            print(e)
+            return None
+        self.tees.add(video_id)
+        # The stream is paced by playback, its bitrate is taken off the bandwidth of the downloads
+        self.bandwidth.open(video_id, bandwidth.PLAYBACK,
+                            (cache_to.get("filesize") or 0) / max(cache_to.get("duration") or 0, 1))
+        return config.TEMP_PATH + cache_to.get("part_name")
+
+    async def finish_stream_cache(self, track, completed: bool):
+        """ Atomically moves a completely played stream into the cache and turns `track` into a cached track,
+        or throws away the partial file of an interrupted stream. """
+        cache_to, track.cache_to = track.cache_to, None
+        video_id = cache_to.get("video_id")
+        part_path = config.TEMP_PATH + cache_to.get("part_name")
+        path = config.TEMP_PATH + cache_to.get("filename")
+        self.tees.discard(video_id)
+        self.bandwidth.close(video_id)
+
+        if completed:
+            try:
+                await self.client.loop.run_in_executor(None, os.replace, part_path, path)
+                size = os.path.getsize(path)
+            except OSError as e:
+                print(e)
+                completed = False
+            else:
+                self.cache.add(video_id, cache_to.get("filename"), cache_to.get("title"), size,
+                               cache_to.get("duration"), cache_to.get("format"), cache_to.get("filesize"))
+                self.background_task(self.analyze_song(video_id, path))
+                track.url = path
+                track.track_type = "music"
+
+        if not completed:
+            self.cache.release(cache_to.get("filesize"))
+            await self.client.loop.run_in_executor(None, cachemanager.remove_files, [part_path])
+
+    async def prefetch_download(self, track):
+        """ Downloads a queued stream of a short song ahead of time so the player can play it from the cache.
+        Returns True if the download got queued. Requests of the song wait for the download like for any other. """
+        cache_to = track.cache_to
+        video_id = cache_to.get("video_id")
+        if (video_id in self.tees) or (video_id in self.in_flight) or (self.catalog.get(video_id) is not None):
+            return False
+        if not self.cache.admit(video_id, cache_to.get("filesize")):
+            return False
 
-                result = await self.client.loop.run_in_executor(
-                    None, lambda: subprocess.run(command, stdout=subprocess.PIPE).returncode)
-                if result == 0:
-                    await self.cache_queue.put(req)
-                else:
-                    await message.channel.send("I ran into an error during download... maybe try again in a few seconds.")
+        req = {
+            "url": track.original_url,
+            "video_id": video_id,
+            "title": cache_to.get("title"),
+            "duration": cache_to.get("duration"),
+            "format_id": cache_to.get("format_id"),
+            "prefetch": True
+        }
+        try:
+            await self.manage_temp_size(req, cache_to.get("filesize"))
+        except OSError as e:
+            print(e)
+            return False
+        self.tees.add(video_id)
+        req["future"] = self.in_flight[video_id] = self.client.loop.create_future()
+        await self.download_queue.put(req)
+        return True
+
+    async def warm_download(self, video_id: str, url: str, video_info):
+        """ Downloads a song nobody requested right now back into the cache. Returns True if the download got
+        queued. """
+        if is_long_video(video_info):
+            return False
+        format_ids = [f.get("format_id") for f in video_info.get("formats", [])]
+        req = {"url": url, "video_id": video_id, "format_id": "251" if "251" in format_ids else "140"}
+        track = self.caching_stream_track(req, video_info)
+        if track.cache_to is None:
+            return False
+        return await self.prefetch_download(track)
+
+    async def download_failed(self, req):
+        """ Cleans up after a download that did not produce a file. """
+        self.cache.release(req.get("reserved_size", 0))
+        self.finish_request(req, None)
+        if req.get("prefetch"):
+            self.tees.discard(req.get("video_id"))
+            return
+        await req.get("message").channel.send("I ran into an error during download... maybe try again in a few seconds.")
 
-        except (asyncio.CancelledError, asyncio.TimeoutError):
-            pass
+    async def manage_temp_size(self, req, filesize: int):
+        """ Reserves room in the temp folder for the requested download of `filesize` bytes. The cache manager evicts
+        the least recently played songs if the new addition would go over the max-size stated in the configuration
+        file. """
+        await self.cache.reserve(filesize)
+        req["reserved_size"] = filesize
 
     async def cache_loop(self):
-        """ Keeps track of files in the temp folder and queues newly added songs. """
-        # Load the cache first
-        temp_list = {}
-        try:
-            temp_list = listdir(config.TEMP_PATH)
-            for filename in temp_list:
-                if filename.endswith(".mp3"):
-                    video_id = filename[len(filename) - 15 : len(filename) - 4]
-                    self.cached_songs[video_id] = filename
-        except FileNotFoundError:
-            print("[Audio] The temp folder does not exist, skipped loading the cache.")
-
+        """ Registers newly downloaded songs in the song catalog and queues them. """
         try:
             while self.running:
                 req = await self.cache_queue.get()
-                video_id = req.get("video_id")
-                
-                # Find file by video_id because the ytdl library filters chars out, title != filename
-                track_title = ""
-                track_url = ""
-                temp_list = listdir(config.TEMP_PATH)
-                for filename in temp_list:
-                    if filename.endswith(video_id + ".mp3"):
-                        self.cached_songs[video_id] = filename
-                        track_title = filename[:len(filename) - 16]
-                        track_url = config.TEMP_PATH + filename
-
-                if (track_title == "") or (track_url == ""):
-                    message = req.get("message")
-                    await message.channel.send("I could not find the downloaded file within my cache... sorry!")
+                with metrics.timed("maon_stage_seconds", stage="cache"):
+                    video_id = req.get("video_id")
+
+                    # The ytdl library filters chars out of the title, the download worker hands over the real filename
+                    filename = req.get("filename")
+                    try:
+                        size = os.path.getsize(config.TEMP_PATH + filename)
+                    except OSError:
+                        self.cache.release(req.get("reserved_size", 0))
+                        self.finish_request(req, None)
+                        if req.get("prefetch"):
+                            self.tees.discard(video_id)
+                            continue
+                        message = req.get("message")
+                        await message.channel.send("I could not find the downloaded file within my cache... sorry!")
+                        continue
 
-                else:
-                    track = {"title": track_title, "url": track_url, "track_type": "music", "message": req.get("message")}
+                    self.cache.add(video_id, filename, req.get("title"), size, req.get("duration"), config.YTDL_DOWNLOAD_CODEC,
+                                   req.get("reserved_size", 0))
+                    self.background_task(self.analyze_song(video_id, config.TEMP_PATH + filename))
+
+                    # A prefetched song is already queued as a stream, the player picks up the cached file by itself.
+                    # Requests that came in during the download get the cached file.
+                    if req.get("prefetch"):
+                        self.tees.discard(video_id)
+                        self.finish_request(req, tracks.Track(req.get("title"), config.TEMP_PATH + filename, "music",
+                                                              video_id=video_id))
+                        continue
+
+                    tracing.mark(req.get("trace"), "cache")
+                    track = tracks.Track(req.get("title"), config.TEMP_PATH + filename, "music", video_id=video_id,
+                                         trace=req.get("trace"), **tracks.requested_by(req.get("message")))
 
                     # Throw the track into the queue of the audioplayer
-                    await self.track_queue.put(track)
+                    self.finish_request(req, track)
+                    await self.track_queue.put((req.get("message"), track))
 
         except (asyncio.CancelledError, asyncio.TimeoutError):
             pass
 
+    async def analyze_song(self, video_id: str, path: str):
+        """ Measures the loudness and silence of a song that was just added to the cache and stores them in the
+        song catalog, so every later playback of it gets leveled and trimmed. """
+        with metrics.timed("maon_stage_seconds", stage="analysis"):
+            result = await self.client.loop.run_in_executor(None, analysis.analyze, path)
+        if self.catalog.get(video_id) is not None:
+            self.catalog.set_analysis(video_id, result)
+
+    async def analyze_backlog(self):
+        """ Analyzes the cached songs one after another that were added before the analysis existed. """
+        backlog = self.catalog.iter_unanalyzed()
+        if backlog:
+            print("[Audio] Analyzing {} cached songs...".format(len(backlog)))
+        for video_id, filename in backlog:
+            if not self.running:
+                return
+            if os.path.exists(config.TEMP_PATH + filename):
+                await self.analyze_song(video_id, config.TEMP_PATH + filename)
+
 
     # Used invocations:
     # play p sfx s volume v vol j next ...
@@ -287,7 +539,11 @@ class Audio(commands.Cog):
             return await message.send(
                 "You can browse the music folder with `browse music`, if you're looking for something specific.")
         elif url.startswith("https://www.youtube.com/") or url.startswith("https://youtu.be/") or url.startswith("https://m.youtube.com/"):
-            await self.prep_link_track(message, url)
+            playlist_id = await get_playlist_id(url)
+            if playlist_id is not None:
+                await self.prep_playlist(message, playlist_id)
+            else:
+                await self.prep_link_track(message, url)
         elif os.path.exists(config.MUSIC_PATH + url + ".mp3"):
             await self.prep_local_track(message, url + ".mp3")
         elif os.path.exists(config.MUSIC_PATH + url + ".wav"):
@@ -298,10 +554,18 @@ class Audio(commands.Cog):
     async def fb_play(self, message, url):
         """ Play command for the filebrowser to play songs selected with reactions. """
         # Check if the requested track is within the cache folder or not because cached mp3s
-        # should not have meta data. The track title is in the filename, though.
+        # should not have meta data. The track title is in the song catalog, though.
         track_title = ""
+        video_id = None
+        entry = None    # catalog or library entry with the analysis of the song
         if url[:url.rfind("/") + 1] == config.TEMP_PATH:
-            track_title = url[url.rfind("/") + 1 : len(url) - 16]
+            entry = self.catalog.get_by_filename(url[url.rfind("/") + 1:])
+            if entry is not None:
+                video_id = entry.get("video_id")
+                self.cache.touch(video_id)
+                track_title = entry.get("title")
+            else:
+                track_title = url[url.rfind("/") + 1 : len(url) - 16]
 
         else:
             # Try to extract meta data with tinytag, most normal mp3 files should have at least a title
@@ -314,7 +578,11 @@ class Audio(commands.Cog):
             except TinyTagException:
                 return
         
-        track = {"title": track_title, "url": url, "track_type": "music", "message": message}
+        if video_id is None:
+            entry = self.music_library.get(url)
+            url = entry.get("path") if entry is not None else url
+        track = tracks.Track(track_title, url, "music", video_id=video_id, **analysis.playback_options(entry),
+                             **tracks.requested_by(message))
         
         # Connection check
         if message.guild.voice_client is None:
@@ -329,25 +597,19 @@ class Audio(commands.Cog):
         elif message.author.voice.channel != message.guild.voice_client.channel:
             return await message.channel.send("Come in here if you want me to play something. :eyes:")
 
-        await self.track_queue.put(track)
+        await self.track_queue.put((message, track))
 
     @commands.command(aliases=["s", "effects", "effect"])
     @commands.guild_only()
     async def sfx(self, message, *, url: str = None):
         """ Plays a local sound effect from the sfx folder specified by a filepath or filename in `url`. """
-        track = {}
         if url is None:
             return await message.send(
                 "You can browse the sfx folder with `browse sfx`, if you're looking for something specific.")
-        elif os.path.exists(config.SFX_PATH + url + ".mp3"):
-            track["url"] = config.SFX_PATH + url + ".mp3"
-        elif os.path.exists(config.SFX_PATH + url + ".wav"):
-            track["url"] = config.SFX_PATH + url + ".wav"
-        else:
+        path = self.sfx_registry.find(url)
+        if path is None:
             return await message.send("Couldn't find the sound effect you were looking for...")
-
-        track["title"] = url
-        track["track_type"] = "sfx"  # link / music / sfx
+        track = tracks.Track(url, path, "sfx", **tracks.requested_by(message))
 
         # Connection check
         if message.guild.voice_client is None:
@@ -364,15 +626,10 @@ class Audio(commands.Cog):
 
         if message.guild.id not in self.players:
             self.players[message.guild.id] = audioplayer.AudioPlayer(self.client, message)
-        return await self.players[message.guild.id].queue.put(track)
+        return await self.players[message.guild.id].play_effect(track)
 
     async def fb_sfx(self, message, url):
         """ Sfx play command for the file browser to play a sound effect selected with a reaction. """ 
-        try:
-            tag = TinyTag.get(url)
-        except TinyTagException:
-            return
-
         # Connection check
         if message.guild.voice_client is None:
             if message.author.voice:
@@ -386,13 +643,31 @@ class Audio(commands.Cog):
         elif message.author.voice.channel != message.guild.voice_client.channel:
             return await message.channel.send("Come in here if you want me to play something. :eyes:")
 
-        if tag.title is None:
-            tag.title = url[url.rfind("/") + 1:]
-        track = {"title": tag.title, "url": url, "track_type": "sfx"}
+        track = tracks.Track(self.sfx_registry.title(url), url, "sfx", **tracks.requested_by(message))
 
         if message.guild.id not in self.players:
             self.players[message.guild.id] = audioplayer.AudioPlayer(self.client, message)
-        await self.players[message.guild.id].queue.put(track)
+        await self.players[message.guild.id].play_effect(track)
+
+    @commands.command()
+    @commands.is_owner()
+    async def library(self, message):
+        """ Transcodes new or changed songs of the music folder into the playback ready music library. """
+        if self.music_library.building:
+            return await message.send("I'm already building the music library.")
+        await message.send("Building the music library, this might take a while...")
+        transcoded = await self.music_library.build()
+        return await message.send("Music library built, I've transcoded {} songs.".format(transcoded))
+
+    @commands.command()
+    @commands.is_owner()
+    async def stats(self, message):
+        """ Shows how long play requests took from the command to their first audio frame, split by how the
+        songs got ready, and what the download workers did so far. """
+        workers = format_worker_stats(self.download_workers)
+        if not any(self.traces.summary(path) for path in tracing.PATHS):
+            return await message.send("Nobody requested a song since I started.\n" + workers)
+        return await message.send(format_trace_stats(self.traces) + "\n" + workers)
 
     @commands.command(aliases=["v", "vol"])
     @commands.guild_only()
@@ -448,8 +723,10 @@ class Audio(commands.Cog):
         elif not message.guild.voice_client.is_playing():
             return
         else:
-            message.guild.voice_client.stop()
-            return await message.send(":track_next: Skipping...")
+            await message.send(":track_next: Skipping...")
+            if message.guild.id in self.players:
+                return await self.players[message.guild.id].skip()
+            return message.guild.voice_client.stop()
 
     @commands.command()
     @commands.guild_only()
@@ -531,6 +808,7 @@ class Audio(commands.Cog):
             return await message.send("Come in here first.")
         else:
             if message.guild.id in self.players:
+                await self.players[message.guild.id].fade_out()
                 self.players[message.guild.id].player_task.cancel()
             else:
                 await message.guild.voice_client.disconnect()
@@ -538,109 +816,96 @@ class Audio(commands.Cog):
     @commands.command(aliases=["queue", "q"])
     @commands.guild_only()
     async def playlist(self, message, *args):
-        """ Displays the current playlist if no `args`. Can rearrange the songs in the playlist with integers describing
-        the current entry position of a song in the playlist and moves them to the front of the playlist. If the first arg is `copy`
-        all following positions are copied to the front of the playlist. If the first arg is `remove` all following positions in the
-        playlist are deleted. """ 
+        """ Displays the current playlist if no `args`, `page` and a number as `args` display later pages of it. Can
+        rearrange the songs in the playlist with integers describing the current entry position of a song in the
+        playlist and moves them to the front of the playlist. If the first arg is `copy` all following positions are
+        copied to the front of the playlist. If the first arg is `remove` all following positions in the playlist are
+        deleted. `shuffle` shuffles the playlist. """ 
         if not message.guild.id in self.players:
             return
-        elif (not self.players[message.guild.id].now_playing) and (self.players[message.guild.id].queue.qsize() == 0):
+        player = self.players[message.guild.id]
+        if (not player.now_playing) and (len(player.queue) == 0):
             return await message.send("I'm not playing anything right now.")
 
-        q_list = list(self.players[message.guild.id].queue._queue)
-
         # No args, just print the current playlist
-        if not args:
-            now_playing_str = ":cd: Now Playing: " + self.players[message.guild.id].now_playing
+        if (not args) or (args[0] in ["page", "p"]):
+            try:
+                page = max(1, int(args[1])) if len(args) > 1 else 1
+            except ValueError:
+                page = 1
+            pages = max(1, -(-len(player.queue) // config.PLAYLIST_MSG_MAX_LEN))
+            page = min(page, pages)
+            start = (page - 1) * config.PLAYLIST_MSG_MAX_LEN
+
+            now_playing_str = ":cd: Now Playing: " + player.now_playing
             playlist_description = ""
             
-            if len(q_list) > 0:
-                i = 1
+            if len(player.queue) > 0:
+                i = start + 1
                 playlist_description += "**Up Next:**\n"
                 
-                for item in q_list:
-                    playlist_description += "  `" + str(i).zfill(2) + "`: " + item.get("title") + "\n"
+                for item in player.queue.peek(config.PLAYLIST_MSG_MAX_LEN, start):
+                    playlist_description += "  `" + str(i).zfill(2) + "`: " + item.title + "\n"
                     i += 1
-                    if i > config.PLAYLIST_MSG_MAX_LEN:
-                        playlist_description += "  •\n  •\n  •"
-                        break
+                if page < pages:
+                    playlist_description += "  •\n  •\n  •"
 
             playlist_embed = Embed(title=now_playing_str, description=playlist_description, color=config.COLOR_HEX)
+            if pages > 1:
+                playlist_embed.set_footer(text="Page {} of {}, {} songs".format(page, pages, len(player.queue)))
             return await message.send(embed=playlist_embed)
 
+        elif args[0] == "shuffle":
+            player.queue.shuffle()
+            player.prefetcher.notify()
+            return await message.send(":twisted_rightwards_arrows: I've shuffled the playlist.")
+
         else:
             # See if the args are only valid integers to restructure the current playlist
             try:
-                positions = await parse_playlist_positions(args, len(q_list))
+                positions = await parse_playlist_positions(args, len(player.queue))
                 
-                # With valid positions, begin restructuring the queue.                
-                new_q_list = []
-                for pos in positions:
-                    new_q_list.append(q_list[pos - 1])
-                    q_list[pos - 1] = 0
-                for item in q_list:
-                    if item == 0:
-                        continue
-                    new_q_list.append(item)
-
-                self.players[message.guild.id].queue = asyncio.Queue()
-                for item in new_q_list:
-                    await self.players[message.guild.id].queue.put(item)
+                # With valid positions, move the songs to the front of the playlist
+                moved = player.queue.move_to_front(positions)
+                player.prefetcher.notify()
                 
                 if len(positions) == 1:
-                    return await message.send("Next up: " + new_q_list[0].get("title"))
+                    return await message.send("Next up: " + moved[0].title)
                 else:
-                    return await message.send("Playlist reorganized, next up: " + new_q_list[0].get("title"))
+                    return await message.send("Playlist reorganized, next up: " + moved[0].title)
 
             # See if the first arg is a command to remove songs from the playlist
             except ValueError:
                 try:
                     if str(args[0]) in ["clear", "delete", "del", "d", "remove", "rm", "r", "copy"] and args[1]:
-                        positions = await parse_playlist_positions(args[1:], len(q_list))
+                        positions = await parse_playlist_positions(args[1:], len(player.queue))
                     else:
                         raise ValueError
 
-                    changed_list = []
                     if args[0] != "copy":
-                        cleared_list = q_list
-                        q_list = []
-                        for pos in positions:
-                            changed_list.append(cleared_list[pos - 1])
-                            cleared_list[pos - 1] = 0
-                        for item in cleared_list:
-                            if item != 0:
-                                q_list.append(item)
-
+                        changed_list = player.queue.remove(positions)
                     else:
-                        copied_list = q_list
-                        q_list = []
-                        for pos in positions:
-                            changed_list.append(copied_list[pos - 1])
-                            q_list.append(copied_list[pos - 1])
-                        for item in copied_list:
-                            q_list.append(item)
-
-                    self.players[message.guild.id].queue = asyncio.Queue()
-                    for item in q_list:
-                        await self.players[message.guild.id].queue.put(item)
+                        changed_list = player.queue.copy_to_front(positions)
+                    player.prefetcher.notify()
                     
                     if args[0] != "copy":
                         if len(positions) == 1:
-                            return await message.send("Removed " + changed_list[0].get("title") + " from the playlist.")
+                            return await message.send("Removed " + changed_list[0].title + " from the playlist.")
                         else:
                             return await message.send("Removed selected tracks from the playlist.")
                     else:
                         if len(positions) == 1:
-                            return await message.send("Copied " + changed_list[0].get("title") + " to the beginning of the playlist.")
+                            return await message.send("Copied " + changed_list[0].title + " to the beginning of the playlist.")
                         else:
                             return await message.send("Copied the selected tracks.")
 
                 # If arg at this point is not a plain clear command, args are invalid, print usage
                 except (ValueError, IndexError):
                     if args[0] in ["clear", "delete", "del", "d", "remove", "rm", "r"] and (len(args) == 1):
-                        self.players[message.guild.id].queue = asyncio.Queue()
+                        player.queue.clear()
+                        player.prefetcher.notify()
                         return await message.send("I've cleared the playlist.")
-                    await message.send("Usage for my playlist command is `" + config.PREFIX[0] + "playlist <1 - " + str(config.PLAYLIST_MSG_MAX_LEN) + ">` if you want to prioritize a song.")   
+                    await message.send("Usage for my playlist command is `" + config.PREFIX[0] + "playlist <1 - " + str(max(1, len(player.queue))) + ">` if you want to prioritize a song.")   
 
     # ═══ Events ═══════════════════════════════════════════════════════════════════════════════════════════════════════
     @commands.Cog.listener()
@@ -648,13 +913,90 @@ class Audio(commands.Cog):
         """ Event listener for the prefix- and command-less sound effect functionality. """
         if message.guild.id in self.players:
             if message.channel == self.players[message.guild.id].message.channel:
-                if os.path.exists(config.SFX_PATH + message.content + ".mp3"):
-                    return await self.fb_sfx(message, config.SFX_PATH + message.content + ".mp3")
-                elif os.path.exists(config.SFX_PATH + message.content + ".wav"):
-                    return await self.fb_sfx(message, config.SFX_PATH + message.content + ".wav")
+                path = self.sfx_registry.find(message.content)
+                if path is not None:
+                    return await self.fb_sfx(message, path)
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        """ Event listener that keeps track of who is in the voice channels of the audioplayers. """
+        if (before.channel == after.channel) or (member.guild.id not in self.players):
+            return
+        if (member.id == self.client.user.id) and (after.channel is None):
+            # Someone disconnected Maon, the audioplayer has nothing to play into anymore
+            self.presence.cancel(member.guild.id)
+            return self.channel_emptied(member.guild)
+        self.presence.update(member.guild)
 
     # ═══ Helper Methods ═══════════════════════════════════════════════════════════════════════════════════════════════
+    def cog_unload(self):
+        """ Stops the loops and audioplayers of the cog. The databases and executors they use are closed by
+        `close` once all of them have been cancelled. """
+        self.running = False
+        self.presence.cancel_all()
+        tasks = [self.info_task, self.cache_task, self.track_task, self.warmer.warm_task, self.sfx_registry.watch_task]
+        tasks += [worker.download_task for worker in self.download_workers]
+        tasks += list(self.background_tasks)
+        for player in list(self.players.values()):
+            player.running = False
+            tasks += [player.player_task, player.prefetcher.prefetch_task]
+        for task in tasks:
+            task.cancel()
+        # Requests that were still being prepared will never finish, whoever waits on them gives up
+        for future in self.in_flight.values():
+            if not future.done():
+                future.set_result(None)
+        self.in_flight.clear()
+        self.unload_task = self.client.loop.create_task(self.close(tasks))
+
+    async def close(self, tasks):
+        # The audioplayers still finish their stream caches and disconnect while they are being cancelled
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.ytdl.shutdown()
+        self.info_cache.close()
+        self.music_library.close()
+        self.cache.history.close()
+        self.catalog.close()
+        print("[Audio] Unloaded.")
+
+    def background_task(self, coro):
+        """ Runs `coro` as a task that gets cancelled when the cog unloads. """
+        task = self.client.loop.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    def get_cached_song(self, video_id: str):
+        """ Returns the catalog entry of `video_id` if its file is in the temp folder, else None. """
+        entry = self.catalog.get(video_id)
+        if (entry is not None) and (not os.path.exists(config.TEMP_PATH + entry.get("filename"))):
+            self.cache.forget(video_id)
+            entry = None
+        return entry
+
+    def finish_request(self, req, track):
+        """ Hands `track` to everyone who requested the same video while `req` was being prepared. A `track` of None
+        tells them that the request failed. Finishing a request twice does nothing. """
+        future = req.get("future")
+        if future is None:
+            return
+        # A later request of the same video might already wait on a future of its own
+        if self.in_flight.get(req.get("video_id")) is future:
+            del self.in_flight[req.get("video_id")]
+        if not future.done():
+            future.set_result(track)
+
+    def channel_emptied(self, guild):
+        """ Cancels the audioplayer of `guild` once everyone left its voice channel. """
+        player = self.players.get(guild.id)
+        if (player is None) or (not player.running):
+            return
+        print("[{}|{}] Users left the voice channel, destroying audioplayer.".format(guild.name, guild.id))
+        player.running = False
+        player.player_task.cancel()
+
     def destroy_player(self, message):
+        self.presence.cancel(message.guild.id)
         if message.guild.id in self.players:
             del self.players[message.guild.id]
             print("[{}|{}] Audioplayer destroyed.".format(message.guild.name, message.guild.id))
@@ -665,7 +1007,7 @@ async def parse_playlist_positions(args, list_length: int):
     positions = []
     for a in args:
         a = int(a)
-        if (a > 0) and (a <= config.PLAYLIST_MSG_MAX_LEN) and (a <= list_length) and (a not in positions):
+        if (a > 0) and (a <= list_length) and (a not in positions):
             positions.append(int(a))
     if len(positions) > 0:
         return positions
@@ -674,29 +1016,25 @@ async def parse_playlist_positions(args, list_length: int):
 
 
 async def volume_gradient(player, message, vol):
-    """ Increments or decrements the volume of the audioplayer in small intervals to generate a 
-    gradient volume increase or decrease for listening comfort. `vol` being the requested volume level.""" 
-    vol_old = int(message.guild.voice_client.source.volume * 100)
+    """ Fades the volume of the audioplayer to the requested volume level `vol` for listening comfort. The fade
+    runs on the audio thread, frame by frame, so this returns right away. """ 
+    if isinstance(player.source, sources.PassthroughOpusAudio):
+        if vol == 100:
+            return await message.send("I'm already playing at 100% volume.")
+        await player.leave_passthrough()
+    vol_old = int(player.volume * 100)
+    # Without a fading song on the mixer, e.g. if it just ended, the volume only applies to the next song
+    transformer = player.mixer.music if player.mixer is not None else None
+    if isinstance(transformer, sources.FadingVolumeTransformer):
+        transformer.fade_to(vol / 100 * player.track.gain, abs(vol - vol_old) / 100 * config.VOLUME_FADE_SPEED)
+    player.volume = vol / 100
+    # The next song has been opened at the old volume already
+    player.preload(reopen=True)
     if vol == 0:
-        while vol_old > 0:
-            vol_old -= 1
-            message.guild.voice_client.source.volume = (vol_old / 100)
-            sleep(0.010)
-        player.volume = 0
         return await message.send("Okay, I'm playing quietly for myself then...")
     elif vol < vol_old:
-        while vol_old > vol:
-            vol_old -= 1
-            message.guild.voice_client.source.volume = (vol_old / 100)
-            sleep(0.010)
-        player.volume = vol / 100
         return await message.send(":arrow_down_small: I've set the volume to {}%.".format(vol))
     else:
-        while vol_old < vol:
-            vol_old += 1
-            message.guild.voice_client.source.volume = (vol_old / 100)
-            sleep(0.010)
-        player.volume = vol / 100
         return await message.send(":arrow_up_small: I've set the volume to {}%.".format(vol))
 
 
@@ -738,6 +1076,66 @@ async def get_video_id(url: str):
         return None
 
 
+async def get_playlist_id(url: str):
+    """ Get the id of the playlist from a link to a Youtube playlist page. Watch links can carry a `list` parameter
+    too, like the ones of mixes, but they ask for their video and not the whole list. """
+    if url.find("/playlist?") < 0:
+        return None
+    for key in ["?list=", "&list="]:
+        if url.find(key) > 0:
+            return url[url.find(key) + len(key):].split("&")[0] or None
+    return None
+
+
+def format_trace_stats(traces):
+    """ Renders the percentiles, a histogram and the median stage times of every path as a code block. """
+    bounds = [0.5, 1, 2, 5, 10, 30, float("inf")]
+    labels = ["<0.5s", "<1s", "<2s", "<5s", "<10s", "<30s", "more"]
+    lines = ["Time to first audio, last {} requests per path".format(traces.window), "",
+             "{:<10}{:>7}{:>9}{:>9}{:>9}".format("path", "count", "p50", "p95", "p99")]
+    for path in tracing.PATHS:
+        summary = traces.summary(path)
+        if summary is not None:
+            lines.append("{:<10}{:>7}{:>8.2f}s{:>8.2f}s{:>8.2f}s".format(path, *summary))
+
+    for path in tracing.PATHS:
+        if traces.summary(path) is None:
+            continue
+        buckets = traces.histogram(path, bounds)
+        most = max(buckets)
+        lines.extend(["", path])
+        for label, bucket in zip(labels, buckets):
+            if bucket:
+                lines.append("  {:<6}{:<20} {}".format(label, "#" * max(1, round(bucket / most * 20)), bucket))
+        lines.append("  " + " > ".join("{} {:.2f}s".format(stage, seconds) for stage, seconds in traces.stage_medians(path)))
+    return "```\n{}\n```".format("\n".join(lines))
+
+
+def format_worker_stats(workers):
+    """ Renders the downloads, failures, busy time and current download of every download worker as a code
+    block. """
+    lines = ["{:<8}{:>10}{:>10}{:>10}{:>12}  {}".format("worker", "downloads", "failures", "busy", "rate", "current")]
+    for stats in [worker.stats() for worker in workers]:
+        lines.append("{:<8}{:>10}{:>10}{:>9.0f}s{:>8.0f}kB/s  {}".format(
+            stats["worker_id"], stats["downloads"], stats["failures"], stats["busy_time"], stats["rate"] / 1024,
+            stats["current"] or "-"))
+    return "```\n{}\n```".format("\n".join(lines))
+
+
+def format_filesize(formats, format_id: str):
+    """ Size in bytes of format `format_id` as announced by Youtube, 0 if unknown. """
+    for f in formats:
+        if f.get("format_id") == format_id:
+            return f.get("filesize") or 0
+    return 0
+
+
+def is_long_video(video_info):
+    """ Live streams and videos longer than the configured maximum are streamed and never cached. """
+    return bool(video_info.get("protocol")) or (config.SONG_DURATION_MAX == 0) or \
+        ((video_info.get("duration") or 0) >= config.SONG_DURATION_MAX)
+
+
 # ═══ Cog Setup ════════════════════════════════════════════════════════════════════════════════════════════════════════
 def setup(client):
     client.add_cog(Audio(client))
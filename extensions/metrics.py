@@ -0,0 +1,141 @@
+from discord.ext import commands
+from extensions.monitor.registry import metrics
+import configuration as config
+import asyncio
+
+
+class Metrics(commands.Cog):
+    """ Serves the metrics of the audio pipeline in the Prometheus text format on a local port. The gauges are read
+    from the other cogs only when the endpoint gets scraped, so the extension costs nothing in between. """
+    __slots__ = ["client", "server", "server_task"]
+
+    def __init__(self, client):
+        self.client = client
+        self.server = None
+        metrics.collectors.append(self.collect)
+        describe_gauges()
+        self.server_task = self.client.loop.create_task(self.start_server())
+
+    async def start_server(self):
+        try:
+            self.server = await asyncio.start_server(self.serve, config.METRICS_HOST, config.METRICS_PORT)
+            print("[Metrics] Serving metrics on http://{}:{}/metrics".format(config.METRICS_HOST, config.METRICS_PORT))
+        except OSError as e:
+            print("[Metrics] Could not open the metrics port: {}".format(e))
+
+    async def serve(self, reader, writer):
+        """ Answers a single HTTP request, only `GET /metrics` is known. """
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            # The headers of the request don't matter
+            while (await asyncio.wait_for(reader.readline(), 5)) not in [b"\r\n", b"\n", b""]:
+                pass
+
+            parts = request.decode("latin-1").split()
+            if (len(parts) >= 2) and (parts[0] == "GET") and (parts[1].split("?")[0] == "/metrics"):
+                status, body = "200 OK", metrics.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+            writer.write("HTTP/1.1 {}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         "Content-Length: {}\r\nConnection: close\r\n\r\n".format(status, len(body)).encode("latin-1"))
+            writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def collect(self):
+        """ Returns `(name, labels, value)` of every gauge at the time of the scrape. """
+        gauges = []
+        audio = self.client.get_cog("Audio")
+        if audio is not None:
+            for name in ["info_queue", "download_queue", "cache_queue", "track_queue"]:
+                gauges.append(("maon_pipeline_queue_length", {"queue": name}, getattr(audio, name).qsize()))
+            gauges.append(("maon_in_flight_requests", {}, len(audio.in_flight)))
+
+            gauges.append(("maon_players", {}, len(audio.players)))
+            ffmpeg_processes = 0
+            for guild_id, player in list(audio.players.items()):
+                gauges.append(("maon_player_queue_length", {"guild": guild_id}, len(player.queue)))
+                sources = [player.source, player.preloaded[3] if player.preloaded is not None else None]
+                ffmpeg_processes += sum(1 for source in sources if is_running(source))
+            gauges.append(("maon_ffmpeg_processes", {}, ffmpeg_processes))
+
+            gauges.append(("maon_cache_bytes", {"kind": "used"}, audio.cache.total_size))
+            gauges.append(("maon_cache_bytes", {"kind": "reserved"}, audio.cache.reserved_size))
+            gauges.append(("maon_cache_bytes", {"kind": "budget"}, audio.cache.budget))
+            gauges.append(("maon_cache_songs", {}, len(audio.cache.recency)))
+            gauges.append(("maon_cache_plays_total", {"result": "hit"}, audio.cache.hits))
+            gauges.append(("maon_cache_plays_total", {"result": "miss"}, audio.cache.misses))
+            gauges.append(("maon_info_cache_lookups_total", {"result": "hit"}, audio.info_cache.hits))
+            gauges.append(("maon_info_cache_lookups_total", {"result": "miss"}, audio.info_cache.misses))
+            gauges.append(("maon_info_cache_lookups_total", {"result": "negative_hit"}, audio.info_cache.negative_hits))
+
+            executors = {"ytdl_info": audio.ytdl.info_executor, "ytdl_download": audio.ytdl.download_executor,
+                         "default": getattr(self.client.loop, "_default_executor", None)}
+            for name, executor in executors.items():
+                if executor is not None:
+                    gauges.append(("maon_executor_threads", {"executor": name}, len(executor._threads)))
+                    gauges.append(("maon_executor_max_threads", {"executor": name}, executor._max_workers))
+                    gauges.append(("maon_executor_pending_jobs", {"executor": name}, executor._work_queue.qsize()))
+
+            gauges.append(("maon_download_workers_busy", {},
+                           sum(1 for worker in audio.download_workers if worker.current is not None)))
+            for stats in [worker.stats() for worker in audio.download_workers]:
+                labels = {"worker": stats["worker_id"]}
+                gauges.append(("maon_download_worker_downloads_total", labels, stats["downloads"]))
+                gauges.append(("maon_download_worker_failures_total", labels, stats["failures"]))
+                gauges.append(("maon_download_worker_busy_seconds_total", labels, stats["busy_time"]))
+                gauges.append(("maon_download_worker_rate_bytes", labels, stats["rate"]))
+            for transfer in audio.bandwidth.stats():
+                gauges.append(("maon_transfer_rate_bytes", {"transfer": transfer.get("name")}, transfer.get("rate")))
+
+        browsers = self.client.get_cog("FileBrowser")
+        if browsers is not None:
+            gauges.append(("maon_file_browsers", {}, len(browsers.filebrowsers)))
+        return gauges
+
+    def cog_unload(self):
+        metrics.collectors.remove(self.collect)
+        self.server_task.cancel()
+        if self.server is not None:
+            self.server.close()
+
+
+# ═══ Functions ════════════════════════════════════════════════════════════════════════════════════════════════════════
+def is_running(source):
+    """ True if `source` has an FFmpeg process that didn't exit yet. """
+    process = getattr(source, "_process", None)
+    return (process is not None) and (process.poll() is None)
+
+
+def describe_gauges():
+    metrics.describe("maon_pipeline_queue_length", "gauge", "Requests waiting in a queue of the Audio cog.")
+    metrics.describe("maon_in_flight_requests", "gauge", "Videos that are being looked up or downloaded.")
+    metrics.describe("maon_players", "gauge", "Active audioplayers.")
+    metrics.describe("maon_player_queue_length", "gauge", "Tracks in the playlist of an audioplayer.")
+    metrics.describe("maon_ffmpeg_processes", "gauge", "Running FFmpeg processes of current and preloaded songs.")
+    metrics.describe("maon_cache_bytes", "gauge", "Bytes used and reserved in the cache and its budget.")
+    metrics.describe("maon_cache_songs", "gauge", "Songs in the cache.")
+    metrics.describe("maon_cache_plays_total", "counter", "Plays of videos that were or weren't cached.")
+    metrics.describe("maon_info_cache_lookups_total", "counter", "Lookups of video meta data by result.")
+    metrics.describe("maon_executor_threads", "gauge", "Threads an executor started.")
+    metrics.describe("maon_executor_max_threads", "gauge", "Threads an executor may start.")
+    metrics.describe("maon_executor_pending_jobs", "gauge", "Jobs waiting for a thread of an executor.")
+    metrics.describe("maon_download_workers_busy", "gauge", "Download workers that are downloading.")
+    metrics.describe("maon_download_worker_downloads_total", "counter", "Songs a download worker downloaded.")
+    metrics.describe("maon_download_worker_failures_total", "counter", "Downloads a download worker failed on.")
+    metrics.describe("maon_download_worker_busy_seconds_total", "counter", "Seconds a download worker spent downloading.")
+    metrics.describe("maon_download_worker_rate_bytes", "gauge", "Current throughput of a download worker.")
+    metrics.describe("maon_transfer_rate_bytes", "gauge", "Current throughput of a download or cached stream.")
+    metrics.describe("maon_file_browsers", "gauge", "Open file browsers.")
+
+
+# ═══ Cog Setup ════════════════════════════════════════════════════════════════════════════════════════════════════════
+def setup(client):
+    client.add_cog(Metrics(client))
+
+
+def teardown(client):
+    client.remove_cog(Metrics)
@@ -0,0 +1,114 @@
+from math import inf
+from time import perf_counter
+
+
+# Upper bounds in seconds of the histogram buckets of every timed stage
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, inf)
+
+
+class MetricsRegistry:
+    """ Counters and histograms of the audio pipeline, kept as plain numbers in dictionaries so counting costs
+    next to nothing when nobody reads them. Gauges aren't stored at all, collectors registered by the metrics cog
+    read them from the cogs at scrape time. Only touched from the event loop. """
+    __slots__ = ["descriptions", "counters", "histograms", "collectors"]
+
+    def __init__(self):
+        self.descriptions = {}  # name: (type, help text)
+        self.counters = {}      # (name, labels): value
+        self.histograms = {}    # (name, labels): [bucket counts, sum, count]
+        self.collectors = []    # functions returning (name, labels, value) of gauges
+
+    def describe(self, name: str, metric_type: str, text: str):
+        self.descriptions[name] = (metric_type, text)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [[0] * len(BUCKETS), 0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[0][i] += 1
+                break
+        histogram[1] += value
+        histogram[2] += 1
+
+    def timed(self, name: str, **labels):
+        """ Returns a context manager that observes the seconds its block took, awaits included. A block that
+        raises is counted in `maon_stage_errors_total` as well. """
+        return Timer(self, name, labels)
+
+    def render(self):
+        """ Returns every metric in the Prometheus text format. """
+        samples = {}
+        for (name, labels), value in self.counters.items():
+            samples.setdefault(name, []).append((name, labels, value))
+        for (name, labels), (buckets, total, count) in self.histograms.items():
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, buckets):
+                cumulative += bucket
+                le = "+Inf" if bound == inf else repr(bound)
+                samples.setdefault(name, []).append((name + "_bucket", labels + (("le", le),), cumulative))
+            samples[name].append((name + "_sum", labels, total))
+            samples[name].append((name + "_count", labels, count))
+        for collector in self.collectors:
+            for name, labels, value in collector():
+                samples.setdefault(name, []).append((name, tuple(sorted(labels.items())), value))
+
+        lines = []
+        for name in sorted(samples):
+            metric_type, text = self.descriptions.get(name, ("untyped", ""))
+            lines.append("# HELP {} {}".format(name, text))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            for sample_name, labels, value in samples[name]:
+                lines.append("{}{} {}".format(sample_name, format_labels(labels), format_value(value)))
+        return "\n".join(lines) + "\n"
+
+
+class Timer:
+    __slots__ = ["registry", "name", "labels", "start"]
+
+    def __init__(self, registry, name: str, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.registry.observe(self.name, perf_counter() - self.start, **self.labels)
+        if (exc_type is not None) and (exc_type.__name__ != "CancelledError"):
+            self.registry.inc("maon_stage_errors_total", **self.labels)
+        return False
+
+
+# The one registry of the bot, the cogs count into it whether the metrics extension is loaded or not
+metrics = MetricsRegistry()
+metrics.describe("maon_stage_seconds", "histogram", "Seconds a stage of the audio pipeline took per item.")
+metrics.describe("maon_stage_errors_total", "counter", "Items a stage of the audio pipeline failed on.")
+metrics.describe("maon_cache_evictions_total", "counter", "Songs evicted from the cache to make room.")
+metrics.describe("maon_cache_rejections_total", "counter", "Songs the cache admission turned away.")
+
+
+# ═══ Functions ════════════════════════════════════════════════════════════════════════════════════════════════════════
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, escape(str(value))) for key, value in labels) + "}"
+
+
+def format_value(value):
+    if value == inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def escape(value: str):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
@@ -0,0 +1,106 @@
+from collections import deque
+from extensions.monitor.registry import metrics
+from itertools import count
+from math import ceil
+from time import perf_counter
+
+
+# Paths a request can take to its first audio frame
+PATHS = ["cache_hit", "local", "download", "stream"]
+
+
+class Trace:
+    """ Follows one play request from the command to its first audio frame. Every stage it passes records the
+    seconds since the request came in, `path` tells how the song got ready and `label` what was requested, the
+    video id or the file. The `trace_id` is logged with the completed trace. """
+    __slots__ = ["trace_id", "path", "label", "start", "stages"]
+
+    ids = count(1)
+
+    def __init__(self, path: str = None, label: str = None):
+        self.trace_id = next(Trace.ids)
+        self.path = path
+        self.label = label
+        self.start = perf_counter()
+        self.stages = []    # (stage, seconds since the request came in)
+
+    def mark(self, stage: str):
+        self.stages.append((stage, perf_counter() - self.start))
+
+    @property
+    def total(self):
+        return self.stages[-1][1] if self.stages else 0.0
+
+    def describe(self):
+        """ One log line of the trace: its id, what was requested, its path and the time of every stage. """
+        return "Trace {} of {} ({}): {:.2f}s to the first audio frame, {}".format(
+            self.trace_id, self.label, self.path, self.total,
+            " > ".join("{} {:.2f}s".format(stage, seconds) for stage, seconds in self.durations()))
+
+    def durations(self):
+        """ Returns `(stage, seconds)` of the time every stage took itself. """
+        durations, last = [], 0.0
+        for stage, elapsed in self.stages:
+            durations.append((stage, elapsed - last))
+            last = elapsed
+        return durations
+
+
+class TraceStats:
+    """ Rolling windows of the last `window` completed traces per path. The percentiles are only computed when
+    someone asks for them, completing a trace just appends to a deque. """
+    __slots__ = ["window", "totals", "stages"]
+
+    def __init__(self, window: int):
+        self.window = window
+        self.totals = {}    # path: deque of seconds to the first audio frame
+        self.stages = {}    # path: {stage: deque of seconds}
+
+    def record(self, trace):
+        if trace.path is None:
+            return
+        self.totals.setdefault(trace.path, deque(maxlen=self.window)).append(trace.total)
+        stages = self.stages.setdefault(trace.path, {})
+        for stage, seconds in trace.durations():
+            stages.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+        metrics.observe("maon_time_to_first_audio_seconds", trace.total, path=trace.path)
+
+    def summary(self, path: str):
+        """ Returns the number of traces and the p50, p95 and p99 of the time to the first audio frame of `path`,
+        None if there are no traces. """
+        totals = self.totals.get(path)
+        if not totals:
+            return None
+        values = sorted(totals)
+        return len(values), percentile(values, 50), percentile(values, 95), percentile(values, 99)
+
+    def stage_medians(self, path: str):
+        """ Returns `(stage, median seconds)` of every stage of `path` in the order they were first seen. """
+        return [(stage, percentile(sorted(values), 50)) for stage, values in self.stages.get(path, {}).items()]
+
+    def histogram(self, path: str, bounds):
+        """ Returns how many traces of `path` finished within each of the upper `bounds`. """
+        buckets = [0] * len(bounds)
+        for total in self.totals.get(path, []):
+            for i, bound in enumerate(bounds):
+                if total <= bound:
+                    buckets[i] += 1
+                    break
+        return buckets
+
+
+metrics.describe("maon_time_to_first_audio_seconds", "histogram",
+                 "Seconds from a play command to the first audio frame, by how the song got ready.")
+
+
+# ═══ Functions ════════════════════════════════════════════════════════════════════════════════════════════════════════
+def mark(trace, stage: str):
+    """ Marks `stage` on `trace`, which is None for requests that aren't traced. """
+    if trace is not None:
+        trace.mark(stage)
+
+
+def percentile(values, p: float):
+    """ Nearest-rank percentile `p` of the sorted `values`. """
+    index = max(0, min(len(values) - 1, ceil(p / 100 * len(values)) - 1))
+    return values[index]
@@ -0,0 +1,67 @@
+import configuration as config
+import re
+import subprocess
+
+
+# Columns the analysis adds to the song catalog and the music library
+ANALYSIS_COLUMNS = [("loudness", "REAL"), ("start_offset", "REAL"), ("end_offset", "REAL")]
+
+
+# ═══ Functions ════════════════════════════════════════════════════════════════════════════════════════════════════════
+def analyze(path: str):
+    """ Runs in an executor or worker process. Measures the integrated loudness of a file and the silence at its
+    start and end in a single FFmpeg pass. Returns a dictionary of the analysis columns, the loudness stays None
+    if FFmpeg couldn't read the file. """
+    analysis = {"loudness": None, "start_offset": 0.0, "end_offset": None}
+    result = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-nostats", "-i", path, "-vn", "-af",
+         "silencedetect=noise={}dB:d={},ebur128=framelog=verbose".format(
+             config.SILENCE_THRESHOLD, config.SILENCE_MIN_DURATION),
+         "-f", "null", "-"],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        return analysis
+    log = result.stderr.decode("utf-8", "replace")
+
+    # The summary at the end is the last integrated loudness in the log
+    loudness = re.findall(r"I:\s+(-?[\d.]+) LUFS", log)
+    if loudness:
+        analysis["loudness"] = float(loudness[-1])
+
+    duration = re.search(r"Duration: (\d+):(\d+):([\d.]+)", log)
+    duration = int(duration.group(1)) * 3600 + int(duration.group(2)) * 60 + float(duration.group(3)) if duration else None
+    starts = [float(s) for s in re.findall(r"silence_start: (-?[\d.]+)", log)]
+    ends = [float(e) for e in re.findall(r"silence_end: (-?[\d.]+)", log)]
+
+    if starts and (starts[0] <= 0.05) and ends and ((duration is None) or (ends[0] < duration - 0.05)):
+        analysis["start_offset"] = ends[0]
+    # Silence that lasts until the end either has no end or ends with the file, depending on the FFmpeg version
+    if starts and ((len(starts) > len(ends)) or ((duration is not None) and (ends[-1] >= duration - 0.05))):
+        if starts[-1] > analysis["start_offset"]:
+            analysis["end_offset"] = starts[-1]
+    return analysis
+
+
+def add_analysis_columns(connection, table: str):
+    """ Adds the analysis columns to `table` if it was created before they existed. """
+    existing = [row[1] for row in connection.execute("PRAGMA table_info({})".format(table))]
+    with connection:
+        for name, column_type in ANALYSIS_COLUMNS:
+            if name not in existing:
+                connection.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, name, column_type))
+
+
+def playback_options(entry):
+    """ Turns the analysis of a catalog or library entry into the gain and the offsets a track is played with. """
+    if entry is None:
+        return {}
+    return {"gain": playback_gain(entry.get("loudness")), "start": entry.get("start_offset") or 0.0,
+            "end": entry.get("end_offset")}
+
+
+def playback_gain(loudness):
+    """ Linear gain that brings a song of `loudness` LUFS to the configured target, quiet songs only get amplified
+    up to a limit so their noise floor doesn't blow up. """
+    if loudness is None:
+        return 1.0
+    return 10 ** (min(config.LOUDNESS_TARGET - loudness, config.LOUDNESS_MAX_GAIN) / 20)
@@ -1,17 +1,30 @@
 from async_timeout import timeout
-from discord import PCMVolumeTransformer
 from discord import FFmpegPCMAudio
 from discord.errors import ClientException
-from youtube_dl import YoutubeDL
+from discord.opus import Encoder as OpusEncoder
+from extensions.monitor import tracing
+from extensions.monitor.registry import metrics
+from extensions.player import analysis
+from extensions.player import infocache
+from extensions.player import mixer
+from extensions.player import playlist
+from extensions.player import prefetcher
+from extensions.player import sources
 from youtube_dl.utils import DownloadError
+from time import perf_counter
 from time import time
 import configuration as config
 import asyncio
 
 
+# Songs that are less than about 1 dB off the loudness target are passed through without leveling them
+PASSTHROUGH_GAIN_TOLERANCE = 0.12
+
+
 class AudioPlayer:
     __slots__ = ["client", "audio", "message", "voice_client", "volume", "looping", "sfx_volume", "player_timeout",
-                 "now_playing", "queue", "next", "running", "player_task", "active_task"]
+                 "now_playing", "queue", "next", "running", "prefetcher", "track", "source", "mixer", "preloaded", "switched",
+                 "cache_path", "player_task"]
 
     def __init__(self, client, message):
         self.client = client
@@ -23,9 +36,16 @@ class AudioPlayer:
         self.sfx_volume = config.SFX_VOLUME
         self.player_timeout = config.PLAYER_TIMEOUT
         self.now_playing = ""
-        self.queue = asyncio.Queue()
+        self.track = None
+        self.source = None      # The current source itself, not the volume transformer around it
+        self.cache_path = None  # Partial cache file the current stream is written into
+        self.mixer = None       # Mixer attached to the voice client, sums the song and the sound effects
+        self.preloaded = None   # (track, url, source, inner source) of the next song, queued in the mixer
+        self.switched = None    # The preloaded song once the mixer switched over to it
+        self.queue = playlist.Playlist()
         self.next = asyncio.Event()
         self.running = True
+        self.prefetcher = prefetcher.Prefetcher(self.client, self, config.PREFETCH_DEPTH)
 
         print("[{}|{}] Creating audioplayer...".format(self.message.guild.name, self.message.guild.id))
         self.player_task = self.client.loop.create_task(self.player_loop())
@@ -33,109 +53,284 @@ class AudioPlayer:
 
     async def player_loop(self):
         await self.client.wait_until_ready()
-
-        # To close the player if the channel is empty
-        self.active_task = self.client.loop.create_task(self.active_loop())
-        track = None
         try:
             while self.running:
                 self.next.clear()
+                self.cache_path = None
+
+                if self.switched is not None:
+                    # The mixer already switched over to the preloaded song on the last frame of the previous one
+                    track = self.track = self.switched[0]
+                    self.source = self.switched[3]
+                    self.switched = None
+                    if self.looping != "song":
+                        self.queue.discard(track)
 
-                if self.looping != "song":
-                    track = None
-                    async with timeout(self.player_timeout):
-                        track = await self.queue.get()
-
-                if track["track_type"] == "stream":     # stream / music / sfx
-                    # Refresh the streaming url if the track has been too long in the Q and is in danger of expiring
-                    if (time() - track.get("time_stamp")) >  600:
-                        track = await self.refresh_url(track)
-                        if track is None: continue
-
-                    self.voice_client.play(
-                        PCMVolumeTransformer(
-                            FFmpegPCMAudio(
-                                track.get("url"),
-                                before_options=config.BEFORE_ARGS,
-                                options=config.FFMPEG_OPTIONS
-                            )
-                        ),
-                        after=lambda _: self.client.loop.call_soon_threadsafe(self.next.set)
-                    )
-                    
-                else:
-                    self.voice_client.play(PCMVolumeTransformer(
-                        FFmpegPCMAudio(track.get("url"), options=config.FFMPEG_OPTIONS)),
-                        after=lambda _: self.client.loop.call_soon_threadsafe(self.next.set))
-
-                if track["track_type"] != "sfx":
-                    self.voice_client.source.volume = self.volume
-                    await self.message.send(":cd: Now playing: {}, at {}% volume.".format(
-                        track.get("title"), (int(self.volume * 100))))
                 else:
-                    self.voice_client.source.volume = self.sfx_volume
-                self.now_playing = track.get("title")
+                    if self.looping != "song":
+                        self.track = None
+                        async with timeout(self.player_timeout):
+                            self.track = await self.queue.get()
+                        self.prefetcher.notify()
+                    track = self.track
+                    start = perf_counter()
+                    tracing.mark(track.trace, "dequeue")
+
+                    # Entries of imported playlists only get looked up right before they play
+                    if track.track_type == "entry":
+                        if not await self.audio.resolve_entry(track):
+                            await self.message.send("I couldn't play {}, skipping it...".format(track.title))
+                            continue
+
+                    # Play short songs from the cache if they got downloaded while they were waiting in the queue
+                    self.use_cached_copy(track)
+
+                    if track.track_type == "stream":     # entry / stream / music / sfx
+                        # Refresh the streaming url if the prefetcher couldn't and it is in danger of expiring
+                        if track.expires - time() < config.PREFETCH_REFRESH_MARGIN:
+                            if await self.refresh_url(track) is None: continue
+
+                        # Write the stream into the cache while it plays if it is a short song
+                        if track.cache_to is not None:
+                            self.cache_path = await self.audio.begin_stream_cache(track)
+
+                    await self.start_music(self.open_source(track))
+                    metrics.observe("maon_stage_seconds", perf_counter() - start, stage="start")
+                    # The voice client reads the first frame right after it started playing
+                    if track.trace is not None:
+                        track.trace.mark("play")
+                        self.audio.traces.record(track.trace)
+                        print("[{}|{}] {}".format(
+                            self.message.guild.name, self.message.guild.id, track.trace.describe()))
+                        track.trace = None
+
+                if track.video_id:
+                    self.audio.cache.played(track.video_id, track.title, track.track_type == "music")
+
+                await self.message.send(":cd: Now playing: {}, at {}% volume.".format(
+                    track.title, (int(self.volume * 100))))
+                self.now_playing = track.title
+                self.prefetcher.notify()
 
                 await self.next.wait()
                 self.now_playing = ""
 
+                if self.cache_path is not None:
+                    self.cache_path = None
+                    await self.audio.finish_stream_cache(track, self.source.completed)
+
                 # Playlist loop
-                if self.looping == "playlist" and track["track_type"] != "sfx":
-                    await self.queue.put(track)
+                if self.looping == "playlist":
+                    self.queue.put(track)
 
         except (asyncio.CancelledError, asyncio.TimeoutError):
             print("[{}|{}] Cancelling audioplayer...".format(self.message.guild.name, self.message.guild.id))
             self.running = False
-            self.active_task.cancel()
+            self.prefetcher.cancel()
             await self.voice_client.disconnect()
+            if self.cache_path is not None:
+                await self.audio.finish_stream_cache(self.track, False)
             return self.audio.destroy_player(self.message)
         
         except ClientException:
             print("[{}|{}] ClientException - Cancelling audioplayer...".format(self.message.guild.name, self.message.guild.id))
             self.running = False
-            self.active_task.cancel()
+            self.prefetcher.cancel()
             try:
+                if self.cache_path is not None:
+                    await self.audio.finish_stream_cache(self.track, False)
                 await self.message.channel.send("I ran into a big error, shutting down my audioplayer...")
                 await self.voice_client.disconnect()
             finally:
                 return self.audio.destroy_player(self.message)
 
+    def open_source(self, track, position: float = 0.0, passthrough: bool = True):
+        """ Opens the audio source of the current song `track` at `position` seconds. """
+        source, self.source = self.create_source(track, position, passthrough, self.cache_path)
+        return source
 
-    async def active_loop(self):
-        """ Periodically checks if Maon is alone in a voice channel and disconnects if True """
-        try:
-            while self.running:
-                if len(self.message.guild.voice_client.channel.voice_states) < 2:
-                    print("[{}|{}] Users left the voice channel, destroying audioplayer.".format(self.message.guild.name,
-                                                                                                self.message.guild.id))
-                    self.running = False
-                    return await self.player_task.cancel()
-                    #await self.voice_client.disconnect()
-                    #return self.audio.destroy_player(self.message)
-                
-                else:
-                    await asyncio.sleep(10)
+    def create_source(self, track, position: float = 0.0, passthrough: bool = True, cache_path=None):
+        """ Returns the source to play `track` at `position` seconds and the FFmpeg source inside of it. Opus encoded
+        songs get their packets passed through without decoding them while the player is at full volume and the song
+        needs no leveling, everything else is decoded for the volume transformer, which applies the gain of the
+        track in the same multiplication as the volume. `position` counts from the end of the silence at the
+        start of the song, silence at its end is cut off. """
+        before_options = config.BEFORE_ARGS if track.track_type == "stream" else None
+        if track.start + position > 0:
+            before_options = "-ss {:.2f} {}".format(track.start + position, before_options or "")
+        options = None
+        if track.end is not None:
+            options = "-t {:.2f}".format(max(track.end - track.start - position, 0))
+
+        # Sound effects can only be mixed into decoded songs
+        effects = (self.mixer is not None) and self.mixer.has_effects()
+        if passthrough and config.OPUS_PASSTHROUGH and (self.volume == 1.0) and (not effects) and \
+                (abs(track.gain - 1.0) < PASSTHROUGH_GAIN_TOLERANCE) and sources.is_opus_track(track):
+            if cache_path is not None:
+                source = sources.CachingFFmpegOpusAudio(track.url, cache_path, before_options=before_options)
+            else:
+                source = sources.PassthroughOpusAudio(track.url, before_options=before_options, options=options)
+            return source, source
+
+        if cache_path is not None:
+            source = sources.CachingFFmpegPCMAudio(track.url, cache_path, before_options=before_options)
+        else:
+            source = FFmpegPCMAudio(track.url, before_options=before_options, options=options or config.FFMPEG_OPTIONS)
+        return sources.FadingVolumeTransformer(source, self.volume * track.gain), source
+
+    def use_cached_copy(self, track):
+        """ Turns a short stream into a cached song if it got downloaded in the meantime. """
+        if (track.track_type == "stream") and (track.cache_to is not None):
+            entry = self.audio.get_cached_song(track.video_id)
+            if entry is not None:
+                track.cache_to = None
+                track.url = config.TEMP_PATH + entry.get("filename")
+                track.track_type = "music"
+                for name, value in analysis.playback_options(entry).items():
+                    setattr(track, name, value)
+
+    def preload(self, reopen: bool = False):
+        """ Opens the source of the next song while the current one plays and queues it in the mixer, which switches
+        over to it on the frame the current song ends. Called whenever the queue changed, `reopen` replaces a
+        preloaded source that is still valid. Preloaded streams are never written into the cache. """
+        if self.switched is not None:
+            # The player loop didn't pick up the last switch yet
+            return
+        upcoming = None
+        if (self.mixer is not None) and self.now_playing:
+            upcoming = self.track if self.looping == "song" else next(iter(self.queue.peek(1)), None)
+        if upcoming is not None:
+            self.use_cached_copy(upcoming)
+            if (upcoming.track_type not in ["stream", "music"]) or \
+                    ((upcoming.track_type == "stream") and (upcoming.expires - time() < config.PREFETCH_REFRESH_MARGIN)):
+                upcoming = None
+
+        if self.preloaded is not None:
+            if (not reopen) and (upcoming is self.preloaded[0]) and (upcoming.url == self.preloaded[1]):
+                return
+            source = self.mixer.cancel_next()
+            if source is None:
+                # The mixer switched over to it already, the player loop picks it up
+                return
+            source.cleanup()
+            self.preloaded = None
+
+        if upcoming is None:
+            return
+        # Decoded songs can be faded into each other, Opus packets can't
+        source, inner = self.create_source(upcoming, passthrough=(config.CROSSFADE_TIME <= 0))
+        if self.mixer.queue_music(source):
+            self.preloaded = (upcoming, upcoming.url, source, inner)
+        else:
+            source.cleanup()
+
+    def open_effect(self, track):
+        """ Opens a sound effect, straight from the sfx bank if it has been decoded already. """
+        frames = self.audio.sfx_bank.get(track.url)
+        if frames is not None:
+            return sources.BankAudioSource(frames)
+        return FFmpegPCMAudio(track.url, options=config.FFMPEG_OPTIONS)
+
+    async def start_music(self, source):
+        """ Hands a song to the mixer if it is still playing sound effects, starts a new mixer for it otherwise. """
+        if (self.mixer is not None) and self.voice_client.is_playing() and self.mixer.play_music(source):
+            return
+        await self.start_mixer(music=source)
+
+    async def play_effect(self, track):
+        """ Mixes a sound effect into the song that is playing, or plays it on its own. """
+        # Opus packets can't be mixed, the song continues on a decoding source
+        if isinstance(self.source, sources.PassthroughOpusAudio):
+            await self.leave_passthrough()
+        source = self.open_effect(track)
+        if ((self.mixer is not None) and (self.voice_client.is_playing() or self.voice_client.is_paused())
+                and self.mixer.add_effect(source, self.sfx_volume)):
+            # The preloaded next song could start before the effect ended, it gets reopened decoded as well
+            if (self.preloaded is not None) and isinstance(self.preloaded[3], sources.PassthroughOpusAudio):
+                self.preload(reopen=True)
+            return
+        await self.start_mixer(effect=source)
+
+    async def start_mixer(self, music=None, effect=None):
+        # A mixer that just ended might still be winding down in the audio thread
+        for _ in range(50):
+            if not self.voice_client.is_playing():
+                break
+            await asyncio.sleep(0.02)
+
+        current = mixer.MixerAudioSource(
+            music, int(config.CROSSFADE_TIME * 1000 / OpusEncoder.FRAME_LENGTH),
+            on_switch=lambda switched: self.client.loop.call_soon_threadsafe(self.music_switched, switched))
+        if effect is not None:
+            current.add_effect(effect, self.sfx_volume)
+        self.mixer = current
+        self.preloaded = None
+        self.voice_client.play(current, after=lambda _: self.client.loop.call_soon_threadsafe(self.mixer_ended, current))
+
+    def mixer_ended(self, ended):
+        # Only the end of the current mixer with a song in it ends the song, effects on their own don't
+        if (ended is self.mixer) and (ended.music is not None):
+            self.next.set()
+
+    def music_switched(self, switched):
+        # The next song started in the mixer, the player loop takes over from here
+        if (switched is self.mixer) and (self.preloaded is not None):
+            self.switched, self.preloaded = self.preloaded, None
+            self.next.set()
+
+    async def skip(self):
+        """ Fades out the current song and lets the mixer switch to the next one right away. """
+        await self.fade_out()
+        if (self.mixer is None) or self.voice_client.is_paused() or (not self.mixer.skip_music()):
+            self.voice_client.stop()
+
+    async def fade_out(self):
+        """ Fades out the song that is playing, so skipping or stopping it doesn't cut it off. Songs that are
+        passed through can't be faded and stop right away. """
+        transformer = self.mixer.music if self.mixer is not None else None
+        if (not isinstance(transformer, sources.FadingVolumeTransformer)) or (not self.voice_client.is_playing()):
+            return
+        transformer.fade_to(0.0, config.FADE_OUT_TIME)
+        await asyncio.sleep(config.FADE_OUT_TIME)
+
+    async def leave_passthrough(self):
+        """ Continues the current song on a decoding source at the same position so its volume can be changed. """
+        if not isinstance(self.source, sources.PassthroughOpusAudio) or (self.mixer is None):
+            return
+        old_source = self.source
+
+        # Copying the stream into the cache doesn't survive the switch, the song gets cached another time
+        cache_path = self.cache_path
+        self.cache_path = None
 
-        except asyncio.CancelledError:
-            pass
+        source = self.open_source(self.track, old_source.position, passthrough=False)
+        # The mixer swaps the sources under its lock, so the audio thread is done with the old one afterwards
+        if self.mixer.play_music(source):
+            old_source.cleanup()
+        else:
+            source.cleanup()
+        if cache_path is not None:
+            await self.audio.finish_stream_cache(self.track, False)
 
-    async def refresh_url(self, track):
-        """ Refreshes the stream url of a track in case it is in danger of expiring. """
-        message = track.get("message")
+    async def refresh_url(self, track, notify: bool = True):
+        """ Refreshes the stream url of a track in case it is in danger of expiring. `notify` sends a message to
+        the channel if that fails. """
         try:
-            video_info = await self.client.loop.run_in_executor(
-                None, lambda: YoutubeDL(config.YTDL_INFO_OPTIONS).extract_info(track.get("original_url"), download=False))
+            video_info = await self.audio.info_cache.extract_info(track.video_id, track.original_url)
 
-            if video_info.get("protocol"):
-                track["url"] = video_info.get("url")
+            f = infocache.stream_format(video_info, track.format_id)
+            if f is None:
+                track.set_stream_url(video_info.get("url"), False)
             else:
-                formats = video_info.get("formats", [video_info])
-                for f in formats:
-                    if f["format_id"] == "251":
-                        track["url"] = f.get("url")
-            track["time_stamp"] = time()
+                if (track.cache_to is not None) and (f.get("format_id") != track.cache_to.get("format_id")):
+                    # The cache file was named after the old format, the song only streams now
+                    track.cache_to = None
+                track.set_stream_url(f.get("url"), f.get("acodec") == "opus")
+                track.format_id = f.get("format_id")
 
             return track
         except DownloadError:
-            await message.channel.send("{}'s streaming link probably expired and I ran into an error.".format(track.get("title")))
+            if not notify:
+                return None
+            await self.message.channel.send("{}'s streaming link probably expired and I ran into an error.".format(track.title))
             return None
@@ -0,0 +1,100 @@
+from time import monotonic
+import threading
+
+
+# Priorities of transfers, lower values go first
+PLAYBACK = 0    # someone waits for the song to play
+PREFETCH = 1    # speculative downloads of upcoming songs
+
+
+class Transfer:
+    """ One download or cached stream that uses the shared bandwidth. `rate` is its current throughput in bytes per
+    second, averaged over the last seconds, `reserved` the bitrate a cached stream is expected to need. """
+    __slots__ = ["name", "priority", "reserved", "bytes", "rate", "updated"]
+
+    def __init__(self, name: str, priority: int, reserved: float = 0.0):
+        self.name = name
+        self.priority = priority
+        self.reserved = reserved
+        self.bytes = 0
+        self.rate = 0.0
+        self.updated = monotonic()
+
+    def add(self, amount: int):
+        now = monotonic()
+        elapsed = max(now - self.updated, 0.001)
+        self.bytes += amount
+        self.rate += (amount / elapsed - self.rate) * min(elapsed / 2.0, 1.0)
+        self.updated = now
+
+
+class BandwidthScheduler:
+    """ A token bucket every download and cached stream shares, so concurrent transfers split the configured
+    bandwidth instead of each getting the full limit, and a single transfer gets all of it. Download threads take
+    tokens for every block they received and block while the bucket is empty, waiting transfers of a higher
+    priority always go first. Cached streams are paced by playback and can't be held back, the bitrate they are
+    expected to need is reserved from the budget instead. A `rate` of None only measures the transfers. """
+    __slots__ = ["rate", "condition", "tokens", "updated", "reserved", "waiting", "transfers"]
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.condition = threading.Condition()
+        self.tokens = rate or 0
+        self.updated = monotonic()
+        self.reserved = 0.0
+        self.waiting = [0, 0]   # waiting download threads per priority
+        self.transfers = {}     # name: Transfer
+
+    def open(self, name: str, priority: int, reserved: float = 0.0):
+        """ Registers a transfer, `reserved` bytes per second are taken off the budget of everyone else until it
+        gets closed. """
+        with self.condition:
+            transfer = self.transfers[name] = Transfer(name, priority, reserved)
+            self.reserved += reserved
+            return transfer
+
+    def close(self, name: str):
+        with self.condition:
+            transfer = self.transfers.pop(name, None)
+            if transfer is not None:
+                self.reserved -= transfer.reserved
+                self.condition.notify_all()
+
+    def consume(self, transfer, amount: int):
+        """ Runs in a download thread. Takes `amount` bytes the transfer received from the bucket and blocks until
+        the bucket isn't overdrawn anymore. """
+        transfer.add(amount)
+        if self.rate is None:
+            return
+        with self.condition:
+            self.waiting[transfer.priority] += 1
+            try:
+                while True:
+                    self.refill()
+                    if (self.tokens > 0) and (not any(self.waiting[:transfer.priority])):
+                        break
+                    self.condition.wait(max(-self.tokens, 1024) / self.available_rate())
+                self.tokens -= amount
+            finally:
+                self.waiting[transfer.priority] -= 1
+                self.condition.notify_all()
+
+    def refill(self):
+        now = monotonic()
+        rate = self.available_rate()
+        # At most one second worth of bandwidth is saved up for later
+        self.tokens = min(self.tokens + (now - self.updated) * rate, rate)
+        self.updated = now
+
+    def available_rate(self):
+        """ Bytes per second left for downloads, a tenth of the budget stays available whatever streams reserved. """
+        return max(self.rate - self.reserved, self.rate / 10)
+
+    def stats(self):
+        """ Returns the current throughput of every transfer. """
+        return [{
+            "name": t.name,
+            "priority": t.priority,
+            "bytes": t.bytes,
+            "rate": t.rate if t.bytes else t.reserved
+        } for t in list(self.transfers.values())]
@@ -0,0 +1,138 @@
+from collections import OrderedDict
+from extensions.monitor.registry import metrics
+import os
+import re
+
+
+# Partial file of a stream that is being cached, titles can contain ".part." themselves
+PARTIAL_STREAM = re.compile(r"-[0-9A-Za-z_-]{11}\.part\.\w+$")
+
+
+class CacheManager:
+    """ Keeps the temp folder under a byte budget. The total size is accounted incrementally and the
+    recency order is fed by play events, so an eviction pops the least recently played song in O(1)
+    instead of scanning the folder. The files themselves are removed in an executor.
+
+    Admission is frequency based in the style of TinyLFU: a song that doesn't fit into the free space is only
+    cached if it has been played more often lately than every song it would evict, so one-off requests can't push
+    out favourites. Plays are counted as hits or misses of the cache. """
+    __slots__ = ["client", "catalog", "history", "temp_path", "budget", "total_size", "reserved_size", "recency",
+                 "hits", "misses"]
+
+    def __init__(self, client, catalog, history, temp_path: str, budget: int):
+        self.client = client
+        self.catalog = catalog
+        self.history = history
+        self.temp_path = temp_path
+        self.budget = budget
+        self.total_size = 0
+        self.reserved_size = 0
+        self.recency = OrderedDict()    # video_id: size in bytes, least recently played first
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(temp_path, exist_ok=True)
+        for video_id, size in self.catalog.iter_by_access():
+            self.recency[video_id] = size
+            self.total_size += size
+        # Nothing is written into the cache yet, partial files are leftovers of a crash and count against no budget
+        stale = partial_files(temp_path)
+        if stale:
+            print("[Audio] Removing {} partial files from the cache...".format(len(stale)))
+            remove_files(stale)
+
+    def admit(self, video_id: str, size: int):
+        """ Returns True if a song of `size` bytes should be cached, either because it fits into the free space or
+        because it was played more often than every song that would be evicted for it. """
+        if size > self.budget:
+            return False
+        needed = self.total_size + self.reserved_size + size - self.budget
+        if needed <= 0:
+            return True
+        frequency = self.history.frequency(video_id)
+        for victim, victim_size in self.recency.items():
+            if self.history.frequency(victim) >= frequency:
+                break
+            needed -= victim_size
+            if needed <= 0:
+                return True
+        metrics.inc("maon_cache_rejections_total")
+        return False
+
+    async def reserve(self, size: int):
+        """ Makes room for a download of `size` bytes by evicting the least recently played songs.
+        Raises OSError if the download could never fit into the budget. """
+        if size > self.budget:
+            raise OSError("[Audio Ext] Requested download is larger than the allowed size of the temp folder. "
+                          "({} > {} bytes)".format(size, self.budget))
+
+        victims = []
+        while (self.total_size + self.reserved_size + size > self.budget) and self.recency:
+            video_id, victim_size = self.recency.popitem(last=False)
+            self.total_size -= victim_size
+            entry = self.catalog.get(video_id)
+            self.catalog.remove(video_id)
+            if entry is not None:
+                victims.append(self.temp_path + entry.get("filename"))
+        self.reserved_size += size
+
+        if victims:
+            metrics.inc("maon_cache_evictions_total", len(victims))
+            await self.client.loop.run_in_executor(None, remove_files, victims)
+
+    def release(self, reserved: int):
+        """ Gives back a reservation of a download that failed. """
+        self.reserved_size = max(0, self.reserved_size - reserved)
+
+    def add(self, video_id: str, filename: str, title: str, size: int, duration, audio_format: str, reserved: int = 0):
+        """ Registers a finished download in the catalog and turns its reservation into accounted bytes. """
+        self.release(reserved)
+        self.catalog.add(video_id, filename, title, size, duration, audio_format)
+        self.total_size += size - self.recency.pop(video_id, 0)
+        self.recency[video_id] = size
+
+    def played(self, video_id: str, title: str, cached: bool):
+        """ Counts a play of a song in the play history and as a hit or miss of the cache. """
+        self.history.record(video_id, title)
+        if cached:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.touch(video_id)
+
+    def touch(self, video_id: str):
+        """ Marks a song as just played. """
+        if video_id in self.recency:
+            self.recency.move_to_end(video_id)
+            self.catalog.touch(video_id)
+
+    def forget(self, video_id: str):
+        """ Drops a song whose file went missing. """
+        self.total_size -= self.recency.pop(video_id, 0)
+        self.catalog.remove(video_id)
+
+    def clear(self):
+        """ Forgets every song after the temp folder was scrubbed and creates the folder again. """
+        self.recency.clear()
+        self.total_size = 0
+        self.catalog.clear()
+        os.makedirs(self.temp_path, exist_ok=True)
+
+
+def partial_files(temp_path: str):
+    """ Paths of the unfinished files in the temp folder: streams that were being cached (`title-id.part.ext`) and
+    downloads of youtube_dl (`title-id.ext.part`, `title-id.ext.ytdl`). """
+    try:
+        filenames = os.listdir(temp_path)
+    except OSError:
+        return []
+    return [temp_path + filename for filename in filenames
+            if PARTIAL_STREAM.search(filename) or filename.endswith((".part", ".ytdl"))]
+
+
+def remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(e)
@@ -0,0 +1,60 @@
+from datetime import datetime
+from youtube_dl.utils import DownloadError
+import asyncio
+
+
+class CacheWarmer:
+    """ Downloads the most played songs that aren't cached anymore back into the cache while nobody listens.
+    Checks every `interval` seconds if the hour of the day is within `hours` and no audioplayer is playing, then
+    queues up to `batch` songs with at least `min_plays` plays as prefetch downloads. Those go through the usual
+    admission and get the bandwidth the downloads of listeners leave over. """
+    __slots__ = ["client", "audio", "interval", "hours", "batch", "min_plays", "warm_task"]
+
+    def __init__(self, client, audio, interval: float, hours, batch: int, min_plays: float):
+        self.client = client
+        self.audio = audio
+        self.interval = interval
+        self.hours = hours
+        self.batch = batch
+        self.min_plays = min_plays
+        self.warm_task = self.client.loop.create_task(self.warm_loop())
+
+    async def warm_loop(self):
+        try:
+            while self.audio.running:
+                await asyncio.sleep(self.interval)
+                if self.is_off_peak():
+                    await self.warm()
+
+        except asyncio.CancelledError:
+            pass
+
+    def is_off_peak(self):
+        if self.hours is None:
+            return False
+        start, end = self.hours
+        hour = datetime.now().hour
+        in_hours = (start <= hour < end) if start <= end else ((hour >= start) or (hour < end))
+        return in_hours and not any(player.now_playing for player in self.audio.players.values())
+
+    async def warm(self):
+        """ Queues the downloads of the most played songs that are missing from the cache. """
+        queued = 0
+        # Cached songs are skipped, so look at more songs than get queued
+        for video_id, title in self.audio.cache.history.most_played(self.batch * 4, self.min_plays):
+            if queued >= self.batch:
+                break
+            if (video_id in self.audio.tees) or (self.audio.get_cached_song(video_id) is not None):
+                continue
+            url = "https://www.youtube.com/watch?v=" + video_id
+            try:
+                video_info = await self.audio.info_cache.extract_info(video_id, url)
+            except DownloadError:
+                continue
+            if await self.audio.warm_download(video_id, url, video_info):
+                queued += 1
+        if queued:
+            print("[Audio] Warming the cache with {} of the most played songs.".format(queued))
+
+    def cancel(self):
+        self.warm_task.cancel()
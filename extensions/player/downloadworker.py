@@ -0,0 +1,68 @@
+from extensions.monitor import tracing
+from extensions.monitor.registry import metrics
+from extensions.player import bandwidth
+from youtube_dl.utils import DownloadError
+from time import time
+import asyncio
+
+
+class DownloadWorker:
+    """ One consumer of the Audio cog's download queue. Several workers run side by side so a slow download
+    only holds up its own worker. The downloads run in-process on the Audio cog's youtube_dl engine and share its
+    bandwidth, requested songs go before prefetched ones. """
+    __slots__ = ["client", "audio", "worker_id", "downloads", "failures", "busy_time", "current", "transfer", "download_task"]
+
+    def __init__(self, client, audio, worker_id: int):
+        self.client = client
+        self.audio = audio
+        self.worker_id = worker_id
+        self.downloads = 0
+        self.failures = 0
+        self.busy_time = 0.0
+        self.current = None     # video_id of the song that is being downloaded right now
+        self.transfer = None    # bandwidth transfer of the current download
+        self.download_task = self.client.loop.create_task(self.download_loop())
+
+    async def download_loop(self):
+        """ Downloads a requested song and stores it in the music cache folder for ease of access and replayability """
+        try:
+            while self.audio.running:
+                req = await self.audio.download_queue.get()
+
+                self.current = req.get("video_id")
+                self.transfer = self.audio.bandwidth.open(
+                    self.current, bandwidth.PREFETCH if req.get("prefetch") else bandwidth.PLAYBACK)
+                start = time()
+                try:
+                    with metrics.timed("maon_stage_seconds", stage="download"):
+                        req["filename"] = await self.audio.ytdl.download(
+                            req.get("url"), req.get("format_id"), self.transfer)
+                except DownloadError as e:
+                    print(e)
+                finally:
+                    self.busy_time += time() - start
+                    self.audio.bandwidth.close(self.current)
+                    self.current = None
+                    self.transfer = None
+
+                if req.get("filename"):
+                    tracing.mark(req.get("trace"), "download")
+                    self.downloads += 1
+                    await self.audio.cache_queue.put(req)
+                else:
+                    self.failures += 1
+                    await self.audio.download_failed(req)
+
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            pass
+
+    def stats(self):
+        return {
+            "worker_id": self.worker_id,
+            "downloads": self.downloads,
+            "failures": self.failures,
+            "busy_time": self.busy_time,
+            "current": self.current,
+            "rate": self.transfer.rate if self.transfer is not None else 0.0
+        }
+
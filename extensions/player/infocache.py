@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from os import makedirs
+from os.path import dirname
+from youtube_dl.utils import DownloadError
+from time import time
+import configuration as config
+import json
+import re
+import sqlite3
+
+
+class InfoCache:
+    """ Two tiered cache for video meta data keyed by video_id. An in-memory LRU sits in front of an SQLite
+    table that survives restarts. Entries expire a margin before the earliest stream url they contain, and
+    failed lookups are remembered for a short negative TTL so dead links don't hit the extractor every time. """
+    __slots__ = ["ytdl", "memory", "memory_size", "connection", "hits", "misses", "negative_hits"]
+
+    def __init__(self, ytdl, path: str, memory_size: int):
+        self.ytdl = ytdl
+        self.memory = OrderedDict()     # video_id: (expires, info, error), least recently used first
+        self.memory_size = memory_size
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+        makedirs(dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS video_info ("
+                "video_id TEXT PRIMARY KEY, expires REAL NOT NULL, info TEXT, error TEXT)")
+            self.connection.execute("DELETE FROM video_info WHERE expires < ?", (time(),))
+
+    async def extract_info(self, video_id: str, url: str):
+        """ Returns the compacted meta data of `video_id`, extracting it from `url` on a miss.
+        Raises DownloadError, also for cached failures. """
+        entry = self.lookup(video_id)
+        if entry is not None:
+            expires, info, error = entry
+            if error is not None:
+                self.negative_hits += 1
+                raise DownloadError(error)
+            self.hits += 1
+            return dict(info)
+
+        self.misses += 1
+        try:
+            video_info = await self.ytdl.extract_info(url)
+        except DownloadError as e:
+            self.store(video_id, time() + config.INFO_CACHE_NEGATIVE_TTL, None, str(e))
+            raise
+
+        info = compact_info(video_info)
+        self.store(video_id, info_expiry(info), info, None)
+        return dict(info)
+
+    def lookup(self, video_id: str):
+        entry = self.memory.get(video_id)
+        if entry is None:
+            row = self.connection.execute(
+                "SELECT expires, info, error FROM video_info WHERE video_id = ?", (video_id,)).fetchone()
+            if row is None:
+                return None
+            entry = (row[0], json.loads(row[1]) if row[1] is not None else None, row[2])
+            self.remember(video_id, entry)
+
+        if entry[0] < time():
+            self.invalidate(video_id)
+            return None
+        self.memory.move_to_end(video_id)
+        return entry
+
+    def store(self, video_id: str, expires: float, info, error):
+        self.remember(video_id, (expires, info, error))
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO video_info (video_id, expires, info, error) VALUES (?, ?, ?, ?)",
+                (video_id, expires, json.dumps(info) if info is not None else None, error))
+
+    def remember(self, video_id: str, entry):
+        self.memory[video_id] = entry
+        self.memory.move_to_end(video_id)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def invalidate(self, video_id: str):
+        self.memory.pop(video_id, None)
+        with self.connection:
+            self.connection.execute("DELETE FROM video_info WHERE video_id = ?", (video_id,))
+
+    def close(self):
+        self.connection.close()
+
+
+# ═══ Functions ════════════════════════════════════════════════════════════════════════════════════════════════════════
+def compact_info(video_info):
+    """ Strips a youtube_dl info dictionary down to what the audio pipeline uses: the audio only formats and
+    the top level url and protocol of live streams. """
+    formats = []
+    for f in video_info.get("formats") or []:
+        if f.get("vcodec") == "none":
+            formats.append({"format_id": f.get("format_id"), "url": f.get("url"), "ext": f.get("ext"),
+                            "acodec": f.get("acodec"), "filesize": f.get("filesize")})
+    return {
+        "id": video_info.get("id"),
+        "title": video_info.get("title"),
+        "duration": video_info.get("duration"),
+        "is_live": video_info.get("is_live"),
+        "protocol": video_info.get("protocol"),
+        "url": video_info.get("url"),
+        "formats": formats
+    }
+
+
+def info_expiry(info):
+    """ Time at which cached meta data has to be dropped, a margin before its first stream url expires. """
+    expires = time() + config.INFO_CACHE_TTL
+    for url in [info.get("url")] + [f.get("url") for f in info.get("formats")]:
+        url_expires = get_url_expiry(url)
+        if url_expires is not None:
+            expires = min(expires, url_expires - config.INFO_CACHE_EXPIRY_MARGIN)
+    return expires
+
+
+def get_url_expiry(url):
+    """ Returns the unix time in the `expire` parameter of a Youtube stream url or None. Manifest urls carry it as
+    a path segment, the other urls as a query parameter. """
+    if not url:
+        return None
+    match = re.search(r"[?&/]expire[=/](\d+)", url)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def stream_format(video_info, format_id=None):
+    """ Returns the audio format `format_id` of `video_info`, or the best audio format it has if that one is
+    missing, preferring Opus. None if there are no formats, like for live streams with only a top level url. """
+    formats = [f for f in video_info.get("formats") or [] if f.get("url")]
+    for wanted in [format_id, "251", "140"]:
+        for f in formats:
+            if (wanted is not None) and (f.get("format_id") == wanted):
+                return f
+    # youtube_dl sorts the formats from worst to best
+    return formats[-1] if formats else None
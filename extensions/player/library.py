@@ -0,0 +1,154 @@
+from concurrent.futures import ProcessPoolExecutor
+from extensions.player.analysis import add_analysis_columns
+from extensions.player.analysis import analyze
+from hashlib import sha1
+from os import makedirs
+from os.path import dirname
+import asyncio
+import os
+import sqlite3
+import subprocess
+
+
+class MusicLibrary:
+    """ Playback ready copies of the music folder. A build transcodes every mp3 / wav file into 48 kHz stereo Opus
+    on a process pool spanning all cores, keyed by the source path and its modification time so only new or
+    changed files get transcoded again. Prepared files can be passed through by the player without decoding.
+    Every prepared file is analyzed for its loudness and silence by the same worker right after transcoding. """
+    __slots__ = ["client", "music_path", "store_path", "connection", "building"]
+
+    def __init__(self, client, music_path: str, store_path: str, index_path: str):
+        self.client = client
+        self.music_path = music_path
+        self.store_path = store_path
+        self.building = False
+        makedirs(store_path, exist_ok=True)
+        makedirs(dirname(index_path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(index_path)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS prepared (source TEXT PRIMARY KEY, mtime REAL NOT NULL, filename TEXT NOT NULL)")
+        add_analysis_columns(self.connection, "prepared")
+
+    def get(self, path: str):
+        """ Returns the prepared version of the music file `path` as a dictionary of its `path` and analysis or None
+        if it is missing or outdated. """
+        source = os.path.relpath(path, self.music_path)
+        row = self.connection.execute(
+            "SELECT mtime, filename, loudness, start_offset, end_offset FROM prepared WHERE source = ?",
+            (source,)).fetchone()
+        if row is None:
+            return None
+        try:
+            if os.stat(path).st_mtime != row[0]:
+                return None
+        except OSError:
+            return None
+        return {"path": self.store_path + row[1], "loudness": row[2], "start_offset": row[3], "end_offset": row[4]}
+
+    async def build(self):
+        """ Transcodes every new or changed file of the music folder and drops the copies of deleted files.
+        Returns the number of transcoded files or None if a build is already running. """
+        if self.building:
+            return None
+        self.building = True
+        try:
+            files = await self.client.loop.run_in_executor(None, scan_music_folder, self.music_path)
+            known = {row[0]: row[1] for row in self.connection.execute("SELECT source, mtime FROM prepared")}
+            unanalyzed = {
+                row[0] for row in self.connection.execute("SELECT source FROM prepared WHERE start_offset IS NULL")}
+
+            # Files prepared before the analysis existed only get analyzed
+            jobs = [(source, mtime) for source, mtime in files.items()
+                    if (known.get(source) != mtime) or (source in unanalyzed)]
+            stale = [source for source in known if source not in files]
+            print("[Audio] Building the music library, {} files to transcode...".format(len(jobs)))
+
+            transcoded = 0
+            # Shut down without waiting, a failed or cancelled build mustn't block the event loop on queued jobs
+            pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+            transcodes = [asyncio.ensure_future(self.transcode(pool, source, mtime, known.get(source) == mtime))
+                          for source, mtime in jobs]
+            try:
+                for job in asyncio.as_completed(transcodes):
+                    try:
+                        source, mtime, filename, analysis = await job
+                    except Exception as e:
+                        print("[Audio] Preparing a file of the music library failed: {}".format(e))
+                        continue
+                    if filename is not None:
+                        transcoded += 1
+                        with self.connection:
+                            self.connection.execute(
+                                "INSERT OR REPLACE INTO prepared "
+                                "(source, mtime, filename, loudness, start_offset, end_offset) VALUES (?, ?, ?, ?, ?, ?)",
+                                (source, mtime, filename, analysis.get("loudness"), analysis.get("start_offset"),
+                                 analysis.get("end_offset")))
+            finally:
+                # Cancelling a transcode drops its job from the pool queue, Python 3.6 has no cancel_futures yet
+                for transcode in transcodes:
+                    transcode.cancel()
+                pool.shutdown(wait=False)
+
+            for source in stale:
+                row = self.connection.execute("SELECT filename FROM prepared WHERE source = ?", (source,)).fetchone()
+                with self.connection:
+                    self.connection.execute("DELETE FROM prepared WHERE source = ?", (source,))
+                if row is not None:
+                    try:
+                        os.remove(self.store_path + row[0])
+                    except OSError:
+                        pass
+
+            print("[Audio] Music library built, transcoded {} of {} files.".format(transcoded, len(jobs)))
+            return transcoded
+        finally:
+            self.building = False
+
+    async def transcode(self, pool, source: str, mtime: float, analyze_only: bool):
+        filename = sha1(source.encode("utf-8")).hexdigest() + ".opus"
+        analysis = await self.client.loop.run_in_executor(
+            pool, prepare, os.path.join(self.music_path, source), self.store_path + filename, analyze_only)
+        return source, mtime, filename if analysis is not None else None, analysis
+
+    def close(self):
+        self.connection.close()
+
+
+# ═══ Functions ════════════════════════════════════════════════════════════════════════════════════════════════════════
+def scan_music_folder(music_path: str):
+    """ Returns `{relative path: mtime}` of the mp3 and wav files in the music folder, hidden folders like the
+    song cache are skipped. """
+    files = {}
+    for root, dirs, filenames in os.walk(music_path):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for filename in filenames:
+            if filename.lower().endswith((".mp3", ".wav")):
+                path = os.path.join(root, filename)
+                files[os.path.relpath(path, music_path)] = os.stat(path).st_mtime
+    return files
+
+
+def prepare(source: str, destination: str, analyze_only: bool):
+    """ Runs in a worker process. Transcodes `source` unless only its analysis is missing and analyzes the prepared
+    file. Returns the analysis or None if transcoding failed. """
+    if (not analyze_only) and (not transcode(source, destination)):
+        return None
+    return analyze(destination)
+
+
+def transcode(source: str, destination: str):
+    """ Runs in a worker process. Transcodes `source` into 48 kHz stereo Opus and moves it into place once done. """
+    part = destination + ".part"
+    result = subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", "-threads", "1", "-i", source, "-vn", "-map_metadata", "-1",
+         "-ar", "48000", "-ac", "2", "-c:a", "libopus", "-b:a", "128k", "-f", "opus", part],
+        stdout=subprocess.DEVNULL)
+    if result.returncode != 0:
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+        return False
+    os.replace(part, destination)
+    return True
@@ -0,0 +1,191 @@
+from collections import deque
+from discord import AudioSource
+from discord.opus import Encoder as OpusEncoder
+import numpy as np
+import threading
+
+
+class MixerAudioSource(AudioSource):
+    """ The one source attached to the voice client of an audioplayer. Sums the frames of the music source and any
+    number of sound effects with their own gain, so an effect is heard on the next frame without interrupting the
+    song. The frames of the music source are handed on untouched while no effect plays, which keeps Opus
+    passthrough working. Ends once the music and every effect ended. Sources are swapped under a lock because
+    `read` runs in the audio thread of the voice client.
+
+    The player can queue the already opened source of the next song, the mixer switches over to it on the frame
+    the current song ends and calls `on_switch` from the audio thread. With `crossfade_frames` the mixer reads
+    decoded songs that many frames ahead and fades the tail of a song into the beginning of the next one. """
+
+    def __init__(self, music=None, crossfade_frames: int = 0, on_switch=None):
+        self.lock = threading.Lock()
+        self.music = music
+        self.music_ended = music is None
+        self.next_music = None
+        self.on_switch = on_switch
+        self.crossfade_frames = crossfade_frames
+        self.buffer = deque()   # frames of the music read ahead
+        self.tail = deque()     # last frames of the previous song while they fade out
+        self.tail_length = 0
+        self.effects = []       # [source, gain]
+        self.finished = False
+        self.opus_frame = False
+
+    def play_music(self, source):
+        """ Replaces the music source. Returns False if the mixer already ended and can't take it anymore. """
+        with self.lock:
+            if self.finished:
+                return False
+            self.music = source
+            self.music_ended = source is None
+            self.buffer.clear()
+            self.tail.clear()
+            return True
+
+    def queue_music(self, source):
+        """ Sets the source the mixer switches to once the current song ended. Returns False if the mixer
+        already ended. """
+        with self.lock:
+            if self.finished:
+                return False
+            self.next_music = source
+            return True
+
+    def cancel_next(self):
+        """ Takes back the queued next source and returns it, None if the mixer already switched over to it. """
+        with self.lock:
+            source, self.next_music = self.next_music, None
+            return source
+
+    def skip_music(self):
+        """ Ends the current song, the mixer switches to the next one on the following frame. Returns False if
+        there is no song to skip. """
+        with self.lock:
+            if self.finished or self.music_ended:
+                return False
+            self.music_ended = True
+            self.buffer.clear()
+            return True
+
+    def add_effect(self, source, gain: float):
+        """ Mixes `source` into the following frames. Returns False if the mixer already ended. """
+        with self.lock:
+            if self.finished:
+                return False
+            self.effects.append([source, gain])
+            return True
+
+    def has_effects(self):
+        return bool(self.effects)
+
+    def read(self):
+        with self.lock:
+            music = self.read_music()
+
+            # Opus packets can't be mixed, the player leaves passthrough before it adds an effect and doesn't
+            # queue Opus songs while effects play. An effect that meets Opus packets anyway keeps running silently
+            # instead of stalling until the song ended.
+            self.opus_frame = bool(music) and (not self.tail_length) and self.music.is_opus()
+            if self.opus_frame and self.effects:
+                self.skip_effect_frames()
+            if (not self.effects) or self.opus_frame:
+                if not music and not self.effects:
+                    self.finished = True
+                return music
+
+            mix = np.zeros(OpusEncoder.SAMPLES_PER_FRAME * OpusEncoder.CHANNELS, dtype=np.float32)
+            if music:
+                mix[:len(music) // 2] += np.frombuffer(music, dtype=np.int16)
+            for effect in list(self.effects):
+                frame = effect[0].read()
+                if not frame:
+                    self.effects.remove(effect)
+                    effect[0].cleanup()
+                    continue
+                mix[:len(frame) // 2] += np.frombuffer(frame, dtype=np.int16) * effect[1]
+
+            if not music and not self.effects and self.music_ended:
+                # The last effect ended on this frame and there is no music left to play
+                self.finished = True
+                return b''
+            np.clip(mix, -32768, 32767, out=mix)
+            return mix.astype(np.int16).tobytes()
+
+    def skip_effect_frames(self):
+        for effect in list(self.effects):
+            if not effect[0].read():
+                self.effects.remove(effect)
+                effect[0].cleanup()
+
+    def read_music(self):
+        """ Returns the next frame of the music, switching to the next song where the current one ends. """
+        if self.music is None:
+            return b''
+        self.read_ahead()
+        if self.music_ended and (self.next_music is not None):
+            self.switch()
+            self.read_ahead()
+
+        frame = self.buffer.popleft() if self.buffer else b''
+        if self.tail:
+            # The weight is taken before the frame leaves the tail, so the last of N frames still gets N / (N + 1)
+            weight = 1 - len(self.tail) / (self.tail_length + 1)
+            old = self.tail.popleft()
+            if self.music.is_opus():
+                # A song that is passed through can't be faded into
+                self.tail.clear()
+            else:
+                frame = crossfade(old, frame, weight)
+        if not self.tail:
+            self.tail_length = 0
+        return frame
+
+    def read_ahead(self):
+        """ Reads one frame of the music, or two while the crossfade buffer still fills up. Opus songs are never
+        read ahead. """
+        lookahead = 0 if self.music.is_opus() else self.crossfade_frames
+        for _ in range(2 if len(self.buffer) < lookahead else 1):
+            if self.music_ended:
+                return
+            frame = self.music.read()
+            if frame:
+                self.buffer.append(frame)
+            else:
+                self.music_ended = True
+
+    def switch(self):
+        old_music = self.music
+        # Whatever is left of the current song fades out while the next one starts
+        self.tail, self.buffer = self.buffer, deque()
+        self.tail_length = len(self.tail)
+        self.music, self.next_music = self.next_music, None
+        self.music_ended = False
+        old_music.cleanup()
+        if self.on_switch is not None:
+            self.on_switch(self)
+
+    def is_opus(self):
+        # Asked by the audio thread right after every `read`
+        return self.opus_frame
+
+    def cleanup(self):
+        with self.lock:
+            self.finished = True
+            for source in [self.music, self.next_music]:
+                if source is not None:
+                    source.cleanup()
+            self.next_music = None
+            for effect in self.effects:
+                effect[0].cleanup()
+            self.effects = []
+
+
+# ═══ Functions ════════════════════════════════════════════════════════════════════════════════════════════════════════
+def crossfade(old: bytes, new: bytes, weight: float):
+    """ Mixes the frame `old` at `1 - weight` into the frame `new` at `weight`. """
+    mix = np.zeros(OpusEncoder.SAMPLES_PER_FRAME * OpusEncoder.CHANNELS, dtype=np.float32)
+    if old:
+        mix[:len(old) // 2] += np.frombuffer(old, dtype=np.int16) * (1 - weight)
+    if new:
+        mix[:len(new) // 2] += np.frombuffer(new, dtype=np.int16) * weight
+    np.clip(mix, -32768, 32767, out=mix)
+    return mix.astype(np.int16).tobytes()
@@ -0,0 +1,63 @@
+from math import log2
+from os import makedirs
+from os.path import dirname
+from time import time
+import sqlite3
+
+
+class PlayHistory:
+    """ Decaying play counts of the most played videos, cached or not. A play loses half of its weight every
+    `half_life` seconds, so the history follows what gets played lately. Only the logarithm of the count at a
+    fixed point in time is stored as `rank`, which orders the videos the same way at any time and lets SQLite
+    find the most and least played ones by an index. The history is capped at `max_size` videos, the least played
+    ones are forgotten first. """
+    __slots__ = ["path", "half_life", "max_size", "size", "connection"]
+
+    def __init__(self, path: str, half_life: float, max_size: int):
+        self.path = path
+        self.half_life = half_life
+        self.max_size = max_size
+        makedirs(dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path)
+
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                "video_id TEXT PRIMARY KEY, title TEXT, rank REAL NOT NULL, last_play REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS history_rank ON history (rank)")
+        self.size = self.connection.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def record(self, video_id: str, title: str):
+        """ Counts a play of `video_id`. """
+        now = time()
+        plays = self.frequency(video_id, now) + 1
+        with self.connection:
+            if self.connection.execute(
+                    "UPDATE history SET title = ?, rank = ?, last_play = ? WHERE video_id = ?",
+                    (title, log2(plays) + now / self.half_life, now, video_id)).rowcount == 0:
+                self.connection.execute(
+                    "INSERT INTO history (video_id, title, rank, last_play) VALUES (?, ?, ?, ?)",
+                    (video_id, title, now / self.half_life, now))
+                self.size += 1
+            if self.size > self.max_size:
+                self.connection.execute(
+                    "DELETE FROM history WHERE video_id IN (SELECT video_id FROM history ORDER BY rank LIMIT ?)",
+                    (self.size - self.max_size,))
+                self.size = self.max_size
+
+    def frequency(self, video_id: str, now=None):
+        """ Returns the decayed number of plays of `video_id`, 0 for videos that were never played. """
+        row = self.connection.execute("SELECT rank FROM history WHERE video_id = ?", (video_id,)).fetchone()
+        if row is None:
+            return 0.0
+        return 2 ** (row[0] - (now or time()) / self.half_life)
+
+    def most_played(self, count: int, min_plays: float = 0.0):
+        """ Returns `(video_id, title)` of up to `count` videos with at least `min_plays` plays, most played first. """
+        min_rank = log2(min_plays) + time() / self.half_life if min_plays > 0 else float("-inf")
+        return self.connection.execute(
+            "SELECT video_id, title FROM history WHERE rank >= ? ORDER BY rank DESC LIMIT ?",
+            (min_rank, count)).fetchall()
+
+    def close(self):
+        self.connection.close()
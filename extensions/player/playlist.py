@@ -0,0 +1,71 @@
+from collections import deque
+from itertools import islice
+import asyncio
+import random
+
+
+class Playlist:
+    """ The queue of an audioplayer. A deque of tracks with an awaitable `get` for the player loop that can be
+    rearranged in place while the player waits on it. Positions are 1-based like in the playlist embed. """
+    __slots__ = ["tracks", "ready"]
+
+    def __init__(self):
+        self.tracks = deque()
+        self.ready = asyncio.Event()
+
+    def __len__(self):
+        return len(self.tracks)
+
+    async def get(self):
+        """ Removes and returns the next track, waits until there is one. """
+        while not self.tracks:
+            self.ready.clear()
+            await self.ready.wait()
+        return self.tracks.popleft()
+
+    def put(self, track):
+        self.tracks.append(track)
+        self.ready.set()
+
+    def extend(self, tracks):
+        self.tracks.extend(tracks)
+        self.ready.set()
+
+    def peek(self, count: int, start: int = 0):
+        """ Returns up to `count` tracks beginning at index `start` without copying the rest of the playlist. """
+        return list(islice(self.tracks, start, start + count))
+
+    def move_to_front(self, positions):
+        """ Moves the tracks at `positions` to the front in the given order and returns them. """
+        tracks = self.remove(positions)
+        self.tracks.extendleft(reversed(tracks))
+        return tracks
+
+    def copy_to_front(self, positions):
+        """ Inserts copies of the tracks at `positions` at the front in the given order and returns them. """
+        tracks = [self.tracks[pos - 1].copy() for pos in positions]
+        self.tracks.extendleft(reversed(tracks))
+        return tracks
+
+    def remove(self, positions):
+        """ Removes the tracks at `positions` and returns them in the given order. """
+        tracks = [self.tracks[pos - 1] for pos in positions]
+        # Deleting from the back keeps the remaining positions valid
+        for pos in sorted(positions, reverse=True):
+            del self.tracks[pos - 1]
+        return tracks
+
+    def discard(self, track):
+        """ Removes `track` itself if it is in the playlist. """
+        try:
+            self.tracks.remove(track)
+        except ValueError:
+            pass
+
+    def shuffle(self):
+        tracks = list(self.tracks)
+        random.shuffle(tracks)
+        self.tracks = deque(tracks)
+
+    def clear(self):
+        self.tracks.clear()
@@ -0,0 +1,111 @@
+from async_timeout import timeout
+from time import time
+import configuration as config
+import asyncio
+import os
+
+
+class Prefetcher:
+    """ Looks `depth` entries ahead in the queue of an audioplayer so song transitions don't wait on the network.
+    Playlist entries are looked up, stream urls are refreshed shortly before they expire, cacheable streams are
+    downloaded ahead of time and cached files are read into the page cache. Sleeps until the queue changes or the
+    next url needs a refresh. """
+    __slots__ = ["client", "player", "depth", "wakeup", "warmed", "failed", "prefetch_task"]
+
+    def __init__(self, client, player, depth: int):
+        self.client = client
+        self.player = player
+        self.depth = depth
+        self.wakeup = asyncio.Event()
+        self.warmed = set()     # urls of upcoming files that are already read ahead
+        self.failed = set()     # video_ids or urls of tracks that couldn't be prepared, the player handles them
+        self.prefetch_task = self.client.loop.create_task(self.prefetch_loop())
+
+    def notify(self):
+        """ Called whenever the queue of the player changed. """
+        self.wakeup.set()
+
+    async def prefetch_loop(self):
+        try:
+            while self.player.running:
+                self.wakeup.clear()
+                deadline = None
+                try:
+                    deadline = await self.prefetch()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print("[{}|{}] Prefetching failed: {}".format(
+                        self.player.message.guild.name, self.player.message.guild.id, e))
+                try:
+                    async with timeout(max(1.0, deadline - time()) if deadline is not None else None):
+                        await self.wakeup.wait()
+                except asyncio.TimeoutError:
+                    pass
+
+        except asyncio.CancelledError:
+            pass
+
+    async def prefetch(self):
+        """ Prepares the upcoming tracks and returns the time of the next necessary url refresh or None. """
+        upcoming = self.player.queue.peek(self.depth)
+        deadline = None
+
+        for track in upcoming:
+            key = track.video_id or track.url
+            if key in self.failed:
+                continue
+            # One broken track mustn't keep the ones after it from being prepared
+            try:
+                refresh_at = await self.prefetch_track(track)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("[{}|{}] Prefetching {} failed: {}".format(
+                    self.player.message.guild.name, self.player.message.guild.id, track.title, e))
+                self.failed.add(key)
+                continue
+            if refresh_at is not None:
+                deadline = refresh_at if deadline is None else min(deadline, refresh_at)
+
+        self.warmed.intersection_update(track.url for track in upcoming)
+        self.player.preload()
+        return deadline
+
+    async def prefetch_track(self, track):
+        """ Prepares one upcoming track and returns the time its stream url needs a refresh or None. """
+        if track.track_type == "entry":
+            await self.player.audio.resolve_entry(track)
+
+        if track.track_type == "stream":
+            if (track.cache_to is not None) and config.PREFETCH_DOWNLOADS:
+                await self.player.audio.prefetch_download(track)
+
+            refresh_at = track.expires - config.PREFETCH_REFRESH_MARGIN
+            if refresh_at <= time():
+                await self.player.refresh_url(track, notify=False)
+                refresh_at = track.expires - config.PREFETCH_REFRESH_MARGIN
+            if refresh_at > time():
+                return refresh_at
+
+        elif (track.track_type == "music") and (track.url not in self.warmed):
+            self.warmed.add(track.url)
+            await self.client.loop.run_in_executor(None, warm_file, track.url)
+        return None
+
+    def cancel(self):
+        self.prefetch_task.cancel()
+
+
+# ═══ Functions ════════════════════════════════════════════════════════════════════════════════════════════════════════
+def warm_file(path: str):
+    """ Asks the OS to read a file into the page cache so FFmpeg can open it without waiting for the disk. """
+    try:
+        with open(path, "rb") as f:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            else:
+                while f.read(1024 * 1024):
+                    pass
+    except OSError:
+        pass
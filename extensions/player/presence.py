@@ -0,0 +1,36 @@
+class VoicePresence:
+    """ Keeps track of the voice channels Maon plays in that everyone else left. Driven by the voice state events
+    the Audio cog receives, so nothing runs while nobody joins or leaves. An emptied channel gets an idle timer on
+    the event loop that calls `on_idle` with its guild once it ran out, anyone who comes back in time cancels it. """
+    __slots__ = ["client", "grace", "on_idle", "timers"]
+
+    def __init__(self, client, grace: float, on_idle):
+        self.client = client
+        self.grace = grace
+        self.on_idle = on_idle
+        self.timers = {}    # guild_id: timer handle of the emptied voice channel
+
+    def update(self, guild):
+        """ Starts or cancels the idle timer of `guild` after someone joined or left its voice channel. """
+        voice_client = guild.voice_client
+        if (voice_client is None) or (voice_client.channel is None):
+            return self.cancel(guild.id)
+        if len(voice_client.channel.voice_states) < 2:
+            if guild.id not in self.timers:
+                self.timers[guild.id] = self.client.loop.call_later(self.grace, self.expire, guild)
+        else:
+            self.cancel(guild.id)
+
+    def expire(self, guild):
+        del self.timers[guild.id]
+        self.on_idle(guild)
+
+    def cancel(self, guild_id: int):
+        timer = self.timers.pop(guild_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def cancel_all(self):
+        for timer in self.timers.values():
+            timer.cancel()
+        self.timers = {}
@@ -0,0 +1,152 @@
+from concurrent.futures import ThreadPoolExecutor
+from discord.opus import Encoder as OpusEncoder
+from hashlib import sha1
+from os import makedirs
+import json
+import mmap
+import os
+import subprocess
+
+
+class SfxBank:
+    """ Every sound effect of the sfx folder pre-decoded into one file of 48 kHz stereo PCM, padded to whole
+    frames and memory-mapped. An offset table maps the sfx paths to their slice of the mapping, so a sound
+    effect starts without spawning FFmpeg. The bank is rebuilt when the sfx folder changes. """
+    __slots__ = ["client", "sfx_path", "bank_path", "signature", "entries", "bank_file", "view", "building", "pending",
+                 "rebuild_requested"]
+
+    def __init__(self, client, sfx_path: str, bank_path: str):
+        self.client = client
+        self.sfx_path = sfx_path
+        self.bank_path = bank_path
+        self.signature = None
+        self.entries = {}       # relative sfx path: (offset, length) in bytes
+        self.bank_file = None
+        self.view = memoryview(b"")
+        self.building = False
+        self.pending = None     # files of a change that came in during a build, None to scan the folder
+        self.rebuild_requested = False
+        makedirs(bank_path, exist_ok=True)
+
+    def get(self, path: str):
+        """ Returns a memoryview of the decoded frames of the sfx file `path` or None if it isn't in the bank. """
+        entry = self.entries.get(os.path.relpath(path, self.sfx_path))
+        if entry is None:
+            return None
+        return self.view[entry[0]:entry[0] + entry[1]]
+
+    async def build(self, files=None):
+        """ Maps the bank of the current sfx folder, decoding it first if the folder changed since the last build.
+        `files` are the sfx paths relative to the sfx folder, the folder is scanned if None. A change that comes in
+        while a build is running gets built right after it. """
+        if self.building:
+            self.pending = files
+            self.rebuild_requested = True
+            return
+        self.building = True
+        try:
+            await self.build_bank(files)
+            while self.rebuild_requested:
+                files, self.pending, self.rebuild_requested = self.pending, None, False
+                await self.build_bank(files)
+        finally:
+            self.building = False
+
+    async def build_bank(self, files):
+        if files is None:
+            files = await self.client.loop.run_in_executor(None, scan_sfx_folder, self.sfx_path)
+        signature = await self.client.loop.run_in_executor(None, folder_signature, self.sfx_path, files)
+        if signature == self.signature:
+            return
+
+        index_path = self.bank_path + "index.json"
+        index = await self.client.loop.run_in_executor(None, read_index, index_path)
+        if (index is None) or (index.get("signature") != signature):
+            print("[Audio] Decoding {} sound effects into the sfx bank...".format(len(files)))
+            index = await self.client.loop.run_in_executor(
+                None, decode_bank, self.sfx_path, self.bank_path, files, signature)
+
+        old_file = self.bank_file
+        self.map(index)
+        if (old_file is not None) and (old_file != self.bank_file):
+            try:
+                os.remove(old_file)
+            except OSError:
+                pass
+
+    def map(self, index):
+        self.bank_file = self.bank_path + index.get("file")
+        with open(self.bank_file, "rb") as f:
+            # Playing sources keep the previous mapping alive through their memoryviews until they are done.
+            # An empty file can't be mapped.
+            if os.fstat(f.fileno()).st_size > 0:
+                self.view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            else:
+                self.view = memoryview(b"")
+        self.entries = {name: tuple(entry) for name, entry in index.get("entries").items()}
+        self.signature = index.get("signature")
+
+
+# ═══ Functions ════════════════════════════════════════════════════════════════════════════════════════════════════════
+def scan_sfx_folder(sfx_path: str):
+    """ Returns the paths of the mp3 and wav files in the sfx folder relative to it. """
+    files = []
+    for root, dirs, filenames in os.walk(sfx_path):
+        for filename in filenames:
+            if filename.lower().endswith((".mp3", ".wav")):
+                files.append(os.path.relpath(os.path.join(root, filename), sfx_path))
+    return sorted(files)
+
+
+def folder_signature(sfx_path: str, files):
+    """ Hash over the names, sizes and modification times of the sfx files. """
+    digest = sha1()
+    for name in files:
+        try:
+            stat = os.stat(os.path.join(sfx_path, name))
+        except OSError:
+            continue
+        digest.update("{}|{}|{}\n".format(name, stat.st_size, stat.st_mtime).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def read_index(index_path: str):
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def decode_file(path: str):
+    """ Decodes a sound effect into 48 kHz stereo PCM, padded with silence to whole frames. """
+    pcm = subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-i", path, "-f", "s16le", "-ar", "48000", "-ac", "2", "pipe:1"],
+        stdout=subprocess.PIPE, stdin=subprocess.DEVNULL).stdout
+    remainder = len(pcm) % OpusEncoder.FRAME_SIZE
+    if remainder:
+        pcm += bytes(OpusEncoder.FRAME_SIZE - remainder)
+    return pcm
+
+
+def decode_bank(sfx_path: str, bank_path: str, files, signature: str):
+    """ Decodes every sfx file in parallel FFmpeg processes into a new bank file and writes its offset table. """
+    filename = "bank-{}.pcm".format(signature[:12])
+    entries = {}
+    offset = 0
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        decoded = pool.map(decode_file, [os.path.join(sfx_path, name) for name in files])
+        with open(bank_path + filename + ".part", "wb") as bank:
+            for name, pcm in zip(files, decoded):
+                if not pcm:
+                    continue
+                bank.write(pcm)
+                entries[name] = (offset, len(pcm))
+                offset += len(pcm)
+    os.replace(bank_path + filename + ".part", bank_path + filename)
+
+    index = {"signature": signature, "file": filename, "entries": entries}
+    with open(bank_path + "index.json.part", "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(bank_path + "index.json.part", bank_path + "index.json")
+    return index
@@ -0,0 +1,108 @@
+from tinytag import TinyTag, TinyTagException
+import asyncio
+import os
+
+
+class SfxRegistry:
+    """ Index of the sfx folder held in memory. Maps the names sound effects are triggered with to their
+    paths and keeps the tag titles of the files, so matching a chat message against the sound effects needs no
+    filesystem calls. The folder is watched by polling the sizes and modification times of its files, `on_change`
+    gets awaited with the relative sfx paths whenever its contents changed. """
+    __slots__ = ["client", "sfx_path", "interval", "on_change", "names", "titles", "state", "watch_task"]
+
+    def __init__(self, client, sfx_path: str, interval: float, on_change=None):
+        self.client = client
+        self.sfx_path = sfx_path
+        self.interval = interval
+        self.on_change = on_change
+        self.names = {}         # name relative to the sfx folder without extension: path
+        self.titles = {}        # path: (mtime, title)
+        self.state = None
+        self.watch_task = self.client.loop.create_task(self.watch_loop())
+
+    def find(self, name: str):
+        """ Returns the path of the sound effect called `name` or None. """
+        return self.names.get(name)
+
+    def title(self, path: str):
+        """ Returns the tag title of the sound effect at `path`, falls back to its filename. """
+        entry = self.titles.get(path)
+        if (entry is None) or (entry[1] is None):
+            return path[path.rfind("/") + 1:]
+        return entry[1]
+
+    async def watch_loop(self):
+        try:
+            while True:
+                await self.refresh()
+                await asyncio.sleep(self.interval)
+
+        except asyncio.CancelledError:
+            pass
+
+    async def refresh(self):
+        """ Rescans the sfx folder if a file was added, removed or renamed or its size or modification time changed.
+        The rescan rebuilds the names the sound effects are matched with exactly. Returns True if it was rescanned. """
+        state = await self.client.loop.run_in_executor(None, folder_state, self.sfx_path)
+        if state == self.state:
+            return False
+        names, titles = await self.client.loop.run_in_executor(None, scan_sfx_folder, self.sfx_path, self.titles)
+        self.names = names
+        self.titles = titles
+        self.state = state
+        if self.on_change is not None:
+            await self.on_change(sorted(os.path.relpath(path, self.sfx_path) for path in titles))
+        return True
+
+    def cancel(self):
+        self.watch_task.cancel()
+
+
+# ═══ Functions ════════════════════════════════════════════════════════════════════════════════════════════════════════
+def folder_state(sfx_path: str):
+    """ Paths, sizes and modification times of every file of the sfx folder. Adding, removing or renaming a file
+    changes the paths, overwriting a file in place changes its size or modification time. """
+    state = []
+    for root, dirs, filenames in os.walk(sfx_path):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            state.append((path, stat.st_size, stat.st_mtime))
+    return sorted(state)
+
+
+def scan_sfx_folder(sfx_path: str, known_titles):
+    """ Returns the name index and the titles of the mp3 and wav files in the sfx folder. Tags are only read for
+    files that are new or changed since `known_titles`, an mp3 wins over a wav file of the same name. """
+    names = {}
+    titles = {}
+    for root, dirs, filenames in os.walk(sfx_path):
+        for filename in sorted(filenames):
+            base, ext = os.path.splitext(filename)
+            # Names are matched exactly, case included, like the paths they stand for
+            if ext not in (".mp3", ".wav"):
+                continue
+            path = os.path.join(root, filename)
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+
+            known = known_titles.get(path)
+            if (known is not None) and (known[0] == mtime):
+                titles[path] = known
+            else:
+                try:
+                    titles[path] = (mtime, TinyTag.get(path).title)
+                except TinyTagException:
+                    titles[path] = (mtime, None)
+
+            name = os.path.join(os.path.relpath(root, sfx_path), base).replace(os.sep, "/")
+            if name.startswith("./"):
+                name = name[2:]
+            if (name not in names) or (ext == ".mp3"):
+                names[name] = path
+    return names, titles
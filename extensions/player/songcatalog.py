@@ -0,0 +1,105 @@
+from extensions.player.analysis import add_analysis_columns
+from os import listdir
+from os import makedirs
+from os.path import dirname
+from os.path import getsize
+from time import time
+import sqlite3
+
+
+class SongCatalog:
+    """ Persistent index of the songs in the temp folder, keyed by video_id. Every lookup hits the primary key
+    of an SQLite table, so neither startup nor a cache hand-off has to list the temp folder. """
+    __slots__ = ["path", "temp_path", "connection"]
+
+    def __init__(self, path: str, temp_path: str):
+        self.path = path
+        self.temp_path = temp_path
+        makedirs(dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS songs ("
+                "video_id TEXT PRIMARY KEY, filename TEXT NOT NULL, title TEXT, size INTEGER NOT NULL DEFAULT 0, "
+                "duration INTEGER, format TEXT, last_access REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS songs_filename ON songs (filename)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS songs_last_access ON songs (last_access)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        add_analysis_columns(self.connection, "songs")
+
+        # One-time migration of a temp folder that was filled before the catalog existed.
+        if self.connection.execute("SELECT value FROM meta WHERE key = 'imported'").fetchone() is None:
+            self.import_folder()
+
+    def get(self, video_id: str):
+        """ Returns the catalog entry of `video_id` as a dictionary or None if the song is not cached. """
+        row = self.connection.execute("SELECT * FROM songs WHERE video_id = ?", (video_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def get_by_filename(self, filename: str):
+        """ Returns the catalog entry of a cached file name or None. """
+        row = self.connection.execute("SELECT * FROM songs WHERE filename = ?", (filename,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def iter_by_access(self):
+        """ Returns `(video_id, size)` of every song, least recently accessed first. """
+        return self.connection.execute("SELECT video_id, size FROM songs ORDER BY last_access").fetchall()
+
+    def add(self, video_id: str, filename: str, title: str, size: int, duration, audio_format: str):
+        """ Adds or replaces a song in a single transaction once its file is complete. """
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO songs (video_id, filename, title, size, duration, format, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (video_id, filename, title, size, duration, audio_format, time()))
+
+    def set_analysis(self, video_id: str, analysis):
+        """ Stores the loudness and silence analysis of a cached song. """
+        with self.connection:
+            self.connection.execute(
+                "UPDATE songs SET loudness = ?, start_offset = ?, end_offset = ? WHERE video_id = ?",
+                (analysis.get("loudness"), analysis.get("start_offset"), analysis.get("end_offset"), video_id))
+
+    def iter_unanalyzed(self):
+        """ Returns `(video_id, filename)` of every song that has not been analyzed yet. """
+        return self.connection.execute("SELECT video_id, filename FROM songs WHERE start_offset IS NULL").fetchall()
+
+    def touch(self, video_id: str):
+        """ Updates the last access time of a song. """
+        with self.connection:
+            self.connection.execute("UPDATE songs SET last_access = ? WHERE video_id = ?", (time(), video_id))
+
+    def remove(self, video_id: str):
+        with self.connection:
+            self.connection.execute("DELETE FROM songs WHERE video_id = ?", (video_id,))
+
+    def clear(self):
+        """ Forgets every song, used when the temp folder gets scrubbed. """
+        with self.connection:
+            self.connection.execute("DELETE FROM songs")
+
+    def close(self):
+        self.connection.close()
+
+    def import_folder(self):
+        """ Indexes songs that were downloaded as `title-video_id.mp3` before the catalog existed. """
+        rows = []
+        try:
+            for filename in listdir(self.temp_path):
+                if filename.endswith(".mp3"):
+                    video_id = filename[len(filename) - 15 : len(filename) - 4]
+                    title = filename[:len(filename) - 16]
+                    size = getsize(self.temp_path + filename)
+                    rows.append((video_id, filename, title, size, None, "mp3", time()))
+        except FileNotFoundError:
+            print("[Audio] The temp folder does not exist, skipped importing the cache.")
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO songs (video_id, filename, title, size, duration, format, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported', ?)", (str(time()),))
+        if rows:
+            print("[Audio] Imported {} cached songs into the song catalog.".format(len(rows)))
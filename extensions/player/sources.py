@@ -0,0 +1,147 @@
+from discord import AudioSource
+from discord import FFmpegAudio
+from discord import FFmpegOpusAudio
+from discord import FFmpegPCMAudio
+from discord import PCMVolumeTransformer
+from discord.oggparse import OggStream
+from discord.opus import Encoder as OpusEncoder
+import numpy as np
+import shlex
+import subprocess
+
+
+class CachingSource:
+    """ Mixin of the FFmpeg sources that copy the untouched audio stream into `cache_path` with the same FFmpeg
+    process that feeds the pipe they play. `completed` turns True once FFmpeg finished both outputs, a skipped or
+    broken stream leaves an incomplete file behind that must not be cached. """
+
+    def start_caching(self, source, cache_path: str, pipe_options, executable, before_options):
+        self.completed = False
+        args = []
+        if isinstance(before_options, str):
+            args.extend(shlex.split(before_options))
+        args.extend(("-i", source))
+        # The cache file is the first output, so its trailer is written before the pipe gets closed
+        args.extend(("-map", "0:a", "-c:a", "copy", "-y", cache_path))
+        args.extend(("-map", "0:a") + pipe_options + ("-loglevel", "warning", "pipe:1"))
+        FFmpegAudio.__init__(self, source, executable=executable, args=args, stdin=subprocess.DEVNULL, stderr=None)
+
+    def finish_caching(self):
+        """ Called at the end of the stream, waits for FFmpeg to finish writing the cache file. """
+        self.completed = self._process.wait() == 0
+
+
+class CachingFFmpegPCMAudio(CachingSource, FFmpegPCMAudio):
+    """ Plays a stream like FFmpegPCMAudio while it is copied into the cache. """
+
+    def __init__(self, source, cache_path: str, *, executable="ffmpeg", before_options=None):
+        self.start_caching(source, cache_path, ("-f", "s16le", "-ar", "48000", "-ac", "2"), executable, before_options)
+
+    def read(self):
+        ret = self._stdout.read(OpusEncoder.FRAME_SIZE)
+        if len(ret) != OpusEncoder.FRAME_SIZE:
+            self.finish_caching()
+            return b''
+        return ret
+
+
+class PassthroughOpusAudio(FFmpegOpusAudio):
+    """ Hands the Opus packets of an Opus encoded file or stream to Discord without decoding and re-encoding
+    them. Counts the frames it played so the song can continue at the same position on a decoding source. """
+
+    def __init__(self, source, *, executable="ffmpeg", before_options=None, options=None):
+        self.frames = 0
+        super().__init__(source, codec="copy", executable=executable, before_options=before_options, options=options)
+
+    def read(self):
+        ret = next(self._packet_iter, b'')
+        if ret:
+            self.frames += 1
+        return ret
+
+    @property
+    def position(self):
+        """ Seconds played so far. """
+        return self.frames * OpusEncoder.FRAME_LENGTH / 1000
+
+
+class CachingFFmpegOpusAudio(CachingSource, PassthroughOpusAudio):
+    """ The passthrough counterpart of CachingFFmpegPCMAudio, both outputs copy the Opus stream untouched. """
+
+    def __init__(self, source, cache_path: str, *, executable="ffmpeg", before_options=None):
+        self.frames = 0
+        self.start_caching(source, cache_path, ("-map_metadata", "-1", "-f", "opus", "-c:a", "copy"), executable,
+                           before_options)
+        self._packet_iter = OggStream(self._stdout).iter_packets()
+
+    def read(self):
+        ret = super().read()
+        if not ret:
+            self.finish_caching()
+        return ret
+
+
+class BankAudioSource(AudioSource):
+    """ Plays a pre-decoded sound effect straight from its slice of the memory-mapped sfx bank. """
+
+    def __init__(self, view):
+        self.view = view
+        self.offset = 0
+
+    def read(self):
+        if self.offset >= len(self.view):
+            return b''
+        frame = self.view[self.offset:self.offset + OpusEncoder.FRAME_SIZE]
+        self.offset += OpusEncoder.FRAME_SIZE
+        # The opus encoder needs bytes, the frame is copied out of the mapping here and nowhere else
+        return frame.tobytes()
+
+    def cleanup(self):
+        self.view = memoryview(b"")
+
+
+class FadingVolumeTransformer(PCMVolumeTransformer):
+    """ A volume transformer that ramps its volume to a target over a number of frames on the audio thread, so
+    nothing has to wait for a fade. The gain is interpolated across the samples of every frame while it ramps,
+    which keeps fades free of audible steps. """
+
+    def __init__(self, original, volume=1.0):
+        super().__init__(original, volume)
+        self.target = self._volume
+        self.step = 0.0
+        self.frames_left = 0
+
+    def fade_to(self, volume: float, seconds: float):
+        """ Starts a ramp from the current volume to `volume` that takes `seconds`. """
+        frames = max(1, int(seconds * 1000 / OpusEncoder.FRAME_LENGTH))
+        self.target = max(volume, 0.0)
+        self.step = (self.target - self._volume) / frames
+        self.frames_left = frames
+
+    @property
+    def fading(self):
+        return self.frames_left > 0
+
+    def read(self):
+        if self.frames_left <= 0:
+            return super().read()
+
+        ret = self.original.read()
+        start = self._volume
+        self.frames_left -= 1
+        self._volume = self.target if self.frames_left == 0 else start + self.step
+        if not ret:
+            return ret
+        samples = np.frombuffer(ret, dtype=np.int16)
+        gains = np.repeat(np.linspace(min(start, 2.0), min(self._volume, 2.0), len(samples) // 2, endpoint=False), 2)
+        ramped = samples[:len(gains)] * gains
+        np.clip(ramped, -32768, 32767, out=ramped)
+        return ramped.astype(np.int16).tobytes()
+
+
+# ═══ Functions ════════════════════════════════════════════════════════════════════════════════════════════════════════
+def is_opus_track(track):
+    """ True if the audio of `track` is Opus encoded and can be passed through. """
+    if track.track_type == "stream":
+        return bool(track.opus)
+    return (track.url or "").endswith(".opus")
@@ -0,0 +1,66 @@
+from extensions.player.infocache import get_url_expiry
+from time import time
+
+
+class Track:
+    """ One entry of a playlist, holding only what playback needs. The requesting message and the meta data of the
+    video are not kept, a queued track is referenced by the ids of its requester and channel instead.
+    `track_type` is one of entry / stream / music / sfx, `format_id` is the Youtube format a stream plays and
+    `cache_to` describes the cache file a short stream is written into while it plays. `gain`, `start` and `end`
+    come from the analysis of a cached or prepared file, they level the song and cut off its silence. `trace`
+    follows the request until the first audio frame of the track and is never copied. """
+    __slots__ = ["title", "url", "track_type", "video_id", "original_url", "expires", "opus", "format_id",
+                 "requester_id", "channel_id", "cache_to", "gain", "start", "end", "trace"]
+
+    def __init__(self, title: str, url, track_type: str, *, video_id=None, original_url=None, opus: bool = False,
+                 format_id=None, requester_id=None, channel_id=None, cache_to=None, gain: float = 1.0,
+                 start: float = 0.0, end=None, trace=None):
+        self.title = title
+        self.url = url
+        self.track_type = track_type
+        self.video_id = video_id
+        self.original_url = original_url
+        self.opus = opus
+        self.format_id = format_id
+        self.requester_id = requester_id
+        self.channel_id = channel_id
+        self.cache_to = cache_to
+        self.gain = gain
+        self.start = start
+        self.end = end
+        self.trace = trace
+        self.expires = None
+        if track_type == "stream":
+            self.set_stream_url(url, opus)
+
+    def set_stream_url(self, url: str, opus: bool):
+        """ Points the track at a new stream url. Urls without an expiry are assumed to last ten minutes. """
+        self.url = url
+        self.opus = opus
+        self.expires = get_url_expiry(url) or (time() + 600)
+
+    def take_over(self, other):
+        """ Turns this track into `other` in place, but keeps its requester. """
+        for name in ["title", "url", "track_type", "video_id", "original_url", "expires", "opus", "format_id",
+                     "cache_to", "gain", "start", "end"]:
+            setattr(self, name, getattr(other, name))
+
+    def copy(self, message=None):
+        """ Returns a copy of the track, requested by the author of `message` if one is given. """
+        track = Track(self.title, self.url, self.track_type, video_id=self.video_id, original_url=self.original_url,
+                      opus=self.opus, format_id=self.format_id, requester_id=self.requester_id,
+                      channel_id=self.channel_id, cache_to=dict(self.cache_to) if self.cache_to is not None else None,
+                      gain=self.gain, start=self.start, end=self.end)
+        track.expires = self.expires
+        if message is not None:
+            track.requester_id = message.author.id
+            track.channel_id = message.channel.id
+        return track
+
+
+# ═══ Functions ════════════════════════════════════════════════════════════════════════════════════════════════════════
+def requested_by(message):
+    """ Keyword arguments of a track requested with `message`, which is None for tracks nobody requested directly. """
+    if message is None:
+        return {}
+    return {"requester_id": message.author.id, "channel_id": message.channel.id}
@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import local
+from youtube_dl import YoutubeDL
+import configuration as config
+import os.path
+
+
+class YTDLEngine:
+    """ Long-lived extraction and download engine. Every executor thread keeps its own YoutubeDL instances,
+    so the extractors and their cached signature functions get reused instead of being rebuilt for every
+    request, and downloads no longer spawn a youtube-dl interpreter. Downloads are throttled by the shared
+    `bandwidth` scheduler from the progress hook of their download thread. """
+    __slots__ = ["client", "bandwidth", "info_executor", "download_executor", "instances"]
+
+    def __init__(self, client, bandwidth, info_threads: int, download_threads: int):
+        self.client = client
+        self.bandwidth = bandwidth
+        self.info_executor = ThreadPoolExecutor(max_workers=info_threads, thread_name_prefix="ytdl-info")
+        self.download_executor = ThreadPoolExecutor(max_workers=download_threads, thread_name_prefix="ytdl-download")
+        self.instances = local()
+
+    async def extract_info(self, url: str):
+        """ Returns the meta data of `url` without downloading it. Raises DownloadError. """
+        return await self.client.loop.run_in_executor(self.info_executor, self._extract_info, url)
+
+    async def extract_playlist(self, url: str):
+        """ Returns the ids and titles of the videos of the playlist at `url` without looking up the videos
+        themselves. Raises DownloadError. """
+        return await self.client.loop.run_in_executor(self.info_executor, self._extract_playlist, url)
+
+    async def download(self, url: str, format_id: str, transfer):
+        """ Downloads format `format_id` of `url` into the temp folder as the bandwidth `transfer`, converts it and
+        returns the file name of the finished file. Raises DownloadError. """
+        return await self.client.loop.run_in_executor(self.download_executor, self._download, url, format_id, transfer)
+
+    def shutdown(self):
+        self.info_executor.shutdown(wait=False)
+        self.download_executor.shutdown(wait=False)
+
+    # ═══ Executor Threads ═════════════════════════════════════════════════════════════════════════════════════════════
+    def _extract_info(self, url: str):
+        ydl = getattr(self.instances, "info", None)
+        if ydl is None:
+            ydl = self.instances.info = YoutubeDL(dict(config.YTDL_INFO_OPTIONS))
+        return ydl.extract_info(url, download=False)
+
+    def _extract_playlist(self, url: str):
+        ydl = getattr(self.instances, "playlist", None)
+        if ydl is None:
+            options = dict(config.YTDL_INFO_OPTIONS)
+            options["extract_flat"] = "in_playlist"
+            options["playlistend"] = config.PLAYLIST_IMPORT_MAX_LEN
+            ydl = self.instances.playlist = YoutubeDL(options)
+        playlist_info = ydl.extract_info(url, download=False)
+        # Only keep what the playlist entries need until they get looked up right before they play
+        return [{"id": e.get("id"), "title": e.get("title")} for e in playlist_info.get("entries") or [] if e.get("id")]
+
+    def _download(self, url: str, format_id: str, transfer):
+        ydl = getattr(self.instances, "download", None)
+        if ydl is None:
+            ydl = self.instances.download = YoutubeDL(dict(config.YTDL_DOWNLOAD_OPTIONS))
+            ydl.add_progress_hook(self._throttle)
+
+        # The instance belongs to this thread alone, so the format and the transfer can be swapped per download
+        ydl.params["format"] = format_id
+        self.instances.transfer = transfer
+        self.instances.received = 0
+        video_info = ydl.extract_info(url, download=True)
+
+        # The audio extraction replaces the extension of the downloaded file
+        filename = ydl.prepare_filename(video_info)
+        return os.path.basename(filename.rpartition(".")[0] + "." + config.YTDL_DOWNLOAD_CODEC)
+
+    def _throttle(self, status):
+        """ Progress hook of the download instances, called after every downloaded block. Blocks the download thread
+        while the shared bandwidth is used up. """
+        if status.get("status") != "downloading":
+            return
+        received = status.get("downloaded_bytes") or 0
+        if received > self.instances.received:
+            self.bandwidth.consume(self.instances.transfer, received - self.instances.received)
+        self.instances.received = received
@@ -0,0 +1,44 @@
+from extensions.player.playlist import Playlist
+import asyncio
+import configuration as config
+import unittest
+
+try:
+    from extensions import audio
+except ImportError:     # discord, youtube_dl or tinytag aren't installed
+    audio = None
+
+
+class PlaylistTest(unittest.TestCase):
+    def setUp(self):
+        self.playlist = Playlist()
+        self.playlist.extend(["song {}".format(i) for i in range(1, config.PLAYLIST_MSG_MAX_LEN * 2 + 1)])
+
+    def test_move_from_second_page(self):
+        position = config.PLAYLIST_MSG_MAX_LEN + 5
+        moved = self.playlist.move_to_front([position])
+        self.assertEqual(moved, ["song {}".format(position)])
+        self.assertEqual(self.playlist.peek(2), ["song {}".format(position), "song 1"])
+        self.assertEqual(len(self.playlist), config.PLAYLIST_MSG_MAX_LEN * 2)
+
+    def test_remove_from_second_page(self):
+        last = len(self.playlist)
+        self.assertEqual(self.playlist.remove([last]), ["song {}".format(last)])
+        self.assertEqual(len(self.playlist), last - 1)
+
+    @unittest.skipIf(audio is None, "the Audio cog needs discord, youtube_dl and tinytag")
+    def test_positions_of_second_page_are_valid(self):
+        loop = asyncio.new_event_loop()
+        try:
+            position = config.PLAYLIST_MSG_MAX_LEN + 5
+            positions = loop.run_until_complete(
+                audio.parse_playlist_positions([str(position)], len(self.playlist)))
+            self.assertEqual(positions, [position])
+            with self.assertRaises(ValueError):
+                loop.run_until_complete(audio.parse_playlist_positions([str(len(self.playlist) + 1)], len(self.playlist)))
+        finally:
+            loop.close()
+
+
+if __name__ == "__main__":
+    unittest.main()